@@ -1,8 +1,11 @@
 from django.contrib import admin
 from django.utils.safestring import mark_safe
 
+from api import shopping_list
+from api.indexes import recipe_ingredient_index
 from api.models import (
-    Ingredient, Recipe, RecipeIngredient, Favorite, ShoppingCart
+    Ingredient, Recipe, RecipeIngredient, Favorite, ShoppingCart,
+    ShoppingListItem, Tag
 )
 
 
@@ -14,6 +17,14 @@ class IngredientAdmin(admin.ModelAdmin):
     list_filter = ('measurement_unit',)
 
 
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'slug', 'bit')
+    list_display_links = ('id', 'name')
+    search_fields = ('name', 'slug')
+    prepopulated_fields = {'slug': ('name',)}
+
+
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
     extra = 1
@@ -28,17 +39,25 @@ class RecipeAdmin(admin.ModelAdmin):
     )
     list_display_links = ('id', 'name')
     search_fields = ('name', 'author__username')
-    list_filter = ('author', 'pub_date')
+    list_filter = ('author', 'tags', 'pub_date')
+    filter_horizontal = ('tags',)
     inlines = (RecipeIngredientInline,)
-    readonly_fields = ('count_favorites', 'pub_date')
+    readonly_fields = ('count_favorites', 'in_carts_count', 'pub_date')
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if change:
+            shopping_list.refresh_recipe(form.instance.pk, None)
+        recipe_ingredient_index.update_on_commit(form.instance.pk)
 
     def get_image(self, obj):
         return mark_safe(f'<img src={obj.image.url} width="80" height="60">')
     get_image.short_description = 'Изображение'
 
     def count_favorites(self, obj):
-        return obj.favorited_by.count()
+        return obj.favorites_count
     count_favorites.short_description = 'В избранном'
+    count_favorites.admin_order_field = 'favorites_count'
 
 
 @admin.register(RecipeIngredient)
@@ -59,4 +78,11 @@ class FavoriteAdmin(admin.ModelAdmin):
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'recipe')
     list_display_links = ('id', 'user')
-    search_fields = ('user__username', 'recipe__name')
\ No newline at end of file
+    search_fields = ('user__username', 'recipe__name')
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'ingredient', 'amount')
+    list_display_links = ('id', 'user')
+    search_fields = ('user__username', 'ingredient__name')
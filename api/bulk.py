@@ -0,0 +1,149 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import ENGAGEMENT_COUNTERS, Favorite, Recipe, ShoppingCart
+from api.shopping_list import refresh_items
+from core.conditional import touch
+from core.counters import actual_count
+from core.pagination import invalidate_counts
+
+ADDED = 'added'
+REMOVED = 'removed'
+ALREADY_ADDED = 'already_added'
+NOT_ADDED = 'not_added'
+OWN_RECIPE = 'own_recipe'
+NOT_FOUND = 'not_found'
+
+
+def sync_engagement(model, user_id, recipe_ids):
+    """Обновляет производные данные после массового изменения без сигналов.
+
+    bulk_create и удаление одним DELETE не вызывают обработчики из
+    api.signals, поэтому счётчики пересчитываются по фактическим строкам
+    одним UPDATE, а список покупок пользователя собирается заново.
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    field = ENGAGEMENT_COUNTERS[model]
+    Recipe.objects.filter(id__in=recipe_ids).update(**{
+        field: actual_count(model, 'recipe'),
+        'engagement_at': timezone.now(),
+    })
+    touch(Recipe)
+    invalidate_counts()
+    if model is ShoppingCart:
+        refresh_items([user_id])
+
+
+def delete_rows(model, user_id, recipe_ids=None):
+    """Удаляет строки пользователя одним DELETE, без выборки и сигналов.
+
+    Возвращает число удалённых строк.
+    """
+    table = model._meta.db_table
+    sql = f'DELETE FROM {table} WHERE user_id = %s'
+    params = [user_id]
+    if recipe_ids is not None:
+        if not recipe_ids:
+            return 0
+        sql += f' AND recipe_id IN ({", ".join(["%s"] * len(recipe_ids))})'
+        params += recipe_ids
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def add(model, user, recipe_ids):
+    """Добавляет рецепты в избранное или корзину пользователя.
+
+    Возвращает список {'id', 'status'} в порядке recipe_ids.
+    """
+    authors = dict(Recipe.objects.filter(id__in=recipe_ids).values_list(
+        'id', 'author_id'
+    ))
+    existing = set(model.objects.filter(
+        user=user, recipe_id__in=authors
+    ).values_list('recipe_id', flat=True))
+    statuses = {}
+    for recipe_id in recipe_ids:
+        if recipe_id not in authors:
+            statuses[recipe_id] = NOT_FOUND
+        elif authors[recipe_id] == user.pk:
+            statuses[recipe_id] = OWN_RECIPE
+        elif recipe_id in existing:
+            statuses[recipe_id] = ALREADY_ADDED
+        else:
+            statuses[recipe_id] = ADDED
+    added = [
+        recipe_id for recipe_id, status in statuses.items()
+        if status == ADDED
+    ]
+    with transaction.atomic():
+        # Строку, добавленную параллельно, пропускает ignore_conflicts,
+        # а счётчики всё равно считаются по фактическим строкам
+        model.objects.bulk_create(
+            (model(user=user, recipe_id=recipe_id) for recipe_id in added),
+            ignore_conflicts=True
+        )
+        sync_engagement(model, user.pk, added)
+    return [
+        {'id': recipe_id, 'status': statuses[recipe_id]}
+        for recipe_id in recipe_ids
+    ]
+
+
+def remove(model, user, recipe_ids):
+    """Убирает рецепты из избранного или корзины пользователя."""
+    rows = model.objects.filter(user=user, recipe_id__in=recipe_ids)
+    with transaction.atomic():
+        present = set(rows.values_list('recipe_id', flat=True))
+        delete_rows(model, user.pk, list(present))
+        sync_engagement(model, user.pk, present)
+    return [
+        {
+            'id': recipe_id,
+            'status': REMOVED if recipe_id in present else NOT_ADDED
+        }
+        for recipe_id in recipe_ids
+    ]
+
+
+def favorites_to_cart(user):
+    """Кладёт в корзину всё избранное пользователя одним INSERT ... SELECT.
+
+    Возвращает число добавленных рецептов.
+    """
+    cart = ShoppingCart._meta.db_table
+    favorite = Favorite._meta.db_table
+    recipe = Recipe._meta.db_table
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {cart} (user_id, recipe_id, created_at) '
+                f'SELECT f.user_id, f.recipe_id, %s FROM {favorite} f '
+                f'JOIN {recipe} r ON r.id = f.recipe_id '
+                f'WHERE f.user_id = %s AND r.author_id <> f.user_id '
+                f'AND NOT EXISTS (SELECT 1 FROM {cart} c '
+                f'WHERE c.user_id = f.user_id AND c.recipe_id = f.recipe_id)',
+                [
+                    connection.ops.adapt_datetimefield_value(timezone.now()),
+                    user.pk
+                ]
+            )
+            added = cursor.rowcount
+        if added:
+            sync_engagement(ShoppingCart, user.pk, Favorite.objects.filter(
+                user=user
+            ).values_list('recipe_id', flat=True))
+    return added
+
+
+def clear_cart(user):
+    """Очищает корзину пользователя одним DELETE; возвращает число рецептов."""
+    rows = ShoppingCart.objects.filter(user=user)
+    with transaction.atomic():
+        recipe_ids = list(rows.values_list('recipe_id', flat=True))
+        deleted = delete_rows(ShoppingCart, user.pk)
+        sync_engagement(ShoppingCart, user.pk, recipe_ids)
+    return deleted
@@ -0,0 +1,147 @@
+from django.conf import settings
+from django.db import transaction
+
+from api.models import FeedEntry, Recipe
+from core.pagination import CustomPagination
+from users.models import Subscription, User
+
+BATCH_SIZE = 1000
+
+
+def fanout_limit():
+    return getattr(settings, 'FEED_FANOUT_MAX_RECIPES', 500)
+
+
+def is_fanned_out(author_id):
+    """Рецепты автора раскладываются по входящим, а не читаются на лету."""
+    return User.objects.filter(
+        pk=author_id, recipes_count__lte=fanout_limit()
+    ).exists()
+
+
+def pulled_author_ids(user):
+    """Авторы из подписок, чьи рецепты подмешиваются при чтении ленты."""
+    return list(Subscription.objects.filter(
+        user=user, author__recipes_count__gt=fanout_limit()
+    ).values_list('author_id', flat=True))
+
+
+def add_entries(pairs, recipes):
+    """Создаёт записи ленты для каждой пары (подписчик, рецепт)."""
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id, recipe_id=recipe_id,
+                author_id=recipes[recipe_id][0],
+                pub_date=recipes[recipe_id][1]
+            )
+            for user_id, recipe_id in pairs
+        ),
+        batch_size=BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def publish(recipe):
+    """Раскладывает новый рецепт по входящим подписчиков автора."""
+    if not is_fanned_out(recipe.author_id):
+        return
+    user_ids = Subscription.objects.filter(
+        author_id=recipe.author_id
+    ).values_list('user_id', flat=True)
+    add_entries(
+        ((user_id, recipe.pk) for user_id in user_ids.iterator()),
+        {recipe.pk: (recipe.author_id, recipe.pub_date)}
+    )
+
+
+def backfill(user_ids, author_id):
+    """Добавляет во входящие подписчиков все рецепты автора."""
+    if not is_fanned_out(author_id):
+        return
+    recipes = {
+        pk: (author_id, pub_date)
+        for pk, pub_date in Recipe.objects.filter(
+            author_id=author_id
+        ).values_list('id', 'pub_date')
+    }
+    add_entries(
+        (
+            (user_id, recipe_id)
+            for user_id in user_ids for recipe_id in recipes
+        ),
+        recipes
+    )
+
+
+def refill_author(author_id):
+    """Восстанавливает входящие, когда автор снова стал обычным.
+
+    Пока рецептов было больше порога, новые рецепты и подписки не
+    раскладывались, поэтому при возвращении к порогу входящие всех
+    подписчиков дополняются рецептами автора.
+    """
+    if not User.objects.filter(
+        pk=author_id, recipes_count=fanout_limit()
+    ).exists():
+        return
+    backfill(
+        list(Subscription.objects.filter(
+            author_id=author_id
+        ).values_list('user_id', flat=True)),
+        author_id
+    )
+
+
+def rebuild():
+    """Собирает входящие заново по подпискам, например после bulk_create."""
+    with transaction.atomic():
+        FeedEntry.objects.all().delete()
+        subscribers = {}
+        for user_id, author_id in Subscription.objects.filter(
+            author__recipes_count__lte=fanout_limit()
+        ).values_list('user_id', 'author_id').iterator():
+            subscribers.setdefault(author_id, []).append(user_id)
+        for author_id, user_ids in subscribers.items():
+            backfill(user_ids, author_id)
+    return FeedEntry.objects.count()
+
+
+class FeedPagination(CustomPagination):
+    """Курсорная пагинация ленты подписок.
+
+    Страница собирается слиянием двух упорядоченных источников: входящих
+    пользователя и рецептов авторов, которые в них не раскладываются.
+    Каждый источник читается по своему индексу с тем же ключом курсора.
+    """
+    cursor_only = True
+    cursor_ordering = ('-pub_date', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Порядок ленты не зависит от ?ordering= у view
+        return super().paginate_queryset(queryset, request)
+
+    def fetch(self, queryset, ordering, values, limit):
+        user = self.request.user
+        inbox_ordering = tuple(
+            {'id': 'recipe_id', '-id': '-recipe_id'}.get(field, field)
+            for field in ordering
+        )
+        keys = super().fetch(
+            FeedEntry.objects.filter(user=user).values_list(
+                'pub_date', 'recipe_id'
+            ),
+            inbox_ordering, values, limit
+        )
+        author_ids = pulled_author_ids(user)
+        if author_ids:
+            keys += super().fetch(
+                Recipe.objects.filter(author_id__in=author_ids).values_list(
+                    'pub_date', 'id'
+                ),
+                ordering, values, limit
+            )
+        keys = sorted(
+            set(keys), reverse=ordering[0].startswith('-')
+        )[:limit]
+        recipes = queryset.in_bulk([pk for _, pk in keys])
+        return [recipes[pk] for _, pk in keys if pk in recipes]
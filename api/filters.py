@@ -1,9 +1,51 @@
+import json
+
+from django import forms
+from django.db import connections
+from django.db.models import F
+from django.db.models.expressions import RawSQL
 from django_filters import rest_framework as filters
+from api.indexes import recipe_ingredient_index, tag_catalog
 from api.models import Ingredient, Recipe
+from api.search import search_recipes
+
+INGREDIENT_SETS = ('has_all', 'has_any', 'exclude', 'pantry')
+# Длинные списки id передаются одним параметром, а не тысячами
+MAX_INLINE_IDS = 500
+
+
+def filter_by_ids(queryset, ids):
+    if not ids:
+        return queryset.none()
+    vendor = connections[queryset.db].vendor
+    if len(ids) <= MAX_INLINE_IDS or vendor not in ('sqlite', 'postgresql'):
+        return queryset.filter(pk__in=ids)
+    if vendor == 'sqlite':
+        return queryset.filter(pk__in=RawSQL(
+            'SELECT value FROM json_each(%s)', [json.dumps(ids)]
+        ))
+    return queryset.filter(pk__in=RawSQL('SELECT unnest(%s)', [ids]))
+
+
+class IngredientIdsFilter(filters.BaseInFilter, filters.NumberFilter):
+    """Список id ингредиентов через запятую."""
+
+
+class SlugListField(forms.Field):
+    """Повторяющийся параметр: ?tags=breakfast&tags=dinner."""
+    widget = forms.SelectMultiple
+
+    def to_python(self, value):
+        return [slug for item in value or () for slug in item.split(',')
+                if slug]
+
+
+class TagSlugsFilter(filters.Filter):
+    field_class = SlugListField
 
 
 class IngredientFilter(filters.FilterSet):
-    search_param = 'name'
+    name = filters.CharFilter(lookup_expr='istartswith')
 
     class Meta:
         model = Ingredient
@@ -16,10 +58,33 @@ class RecipeFilter(filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
+    tags = TagSlugsFilter(method='filter_tags')
+    has_all = IngredientIdsFilter()
+    has_any = IngredientIdsFilter()
+    exclude = IngredientIdsFilter()
+    pantry = IngredientIdsFilter()
 
     class Meta:
         model = Recipe
-        fields = ('author', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'author', 'is_favorited', 'is_in_shopping_cart', 'search', 'tags',
+            *INGREDIENT_SETS
+        )
+
+    def filter_queryset(self, queryset):
+        # Фильтры по составу считаются вместе по индексу в памяти
+        conditions = {}
+        for name in INGREDIENT_SETS:
+            value = self.form.cleaned_data.pop(name, None)
+            if value:
+                conditions[name] = [int(item) for item in value]
+        queryset = super().filter_queryset(queryset)
+        if conditions:
+            queryset = filter_by_ids(
+                queryset, recipe_ingredient_index.match(**conditions)
+            )
+        return queryset
 
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
@@ -29,4 +94,17 @@ class RecipeFilter(filters.FilterSet):
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
             return queryset.filter(in_shopping_cart__user=self.request.user)
-        return queryset
\ No newline at end of file
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def filter_tags(self, queryset, name, value):
+        # Рецепт подходит, если у него есть хотя бы один из тегов: одна
+        # проверка маски в строке рецепта вместо JOIN с DISTINCT
+        mask = tag_catalog.mask_for(value)
+        if not mask:
+            return queryset.none()
+        return queryset.alias(
+            tag_match=F('tag_mask').bitand(mask)
+        ).filter(tag_match__gt=0)
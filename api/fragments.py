@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from core.telemetry import registry
+
+
+def fragment_key(recipe_id):
+    return f'recipes:fragment:{recipe_id}'
+
+
+def fragment_version(recipe, request):
+    # Проверка версии страхует от пропущенных сигналов: обновления через
+    # QuerySet.update() тоже меняют updated_at. Хост входит в версию, потому
+    # что ссылки на изображения абсолютные
+    return (
+        recipe.updated_at.isoformat(), recipe.author.updated_at.isoformat(),
+        request.get_host() if request is not None else '',
+    )
+
+
+def invalidate(recipe_ids):
+    cache.delete_many([fragment_key(recipe_id) for recipe_id in recipe_ids])
+
+
+def render(recipes, build, request):
+    """Общие для всех пользователей части карточек рецептов.
+
+    Берёт фрагменты из кэша одним get_many, недостающие строит через
+    build(recipe) и сохраняет одним set_many.
+    """
+    keys = [fragment_key(recipe.pk) for recipe in recipes]
+    cached = cache.get_many(keys)
+    result, missing = [], {}
+    for key, recipe in zip(keys, recipes):
+        version = fragment_version(recipe, request)
+        entry = cached.get(key)
+        if entry is not None and entry['version'] == version:
+            result.append(entry['data'])
+            continue
+        data = build(recipe)
+        missing[key] = {'version': version, 'data': data}
+        result.append(data)
+    if missing:
+        cache.set_many(missing, getattr(
+            settings, 'RECIPE_FRAGMENT_CACHE_TIMEOUT', 3600
+        ))
+    registry.increment('recipe_fragments.hits', len(recipes) - len(missing))
+    registry.increment('recipe_fragments.misses', len(missing))
+    return result
@@ -0,0 +1,397 @@
+import gzip
+import hashlib
+import re
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import reduce
+from operator import or_
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+from api.models import Ingredient, Recipe, RecipeIngredient, Tag
+from core.pagination import invalidate_counts
+from core.routers import primary_reads
+
+try:
+    import brotli
+except ImportError:  # brotli не обязателен, без него отдаём gzip
+    brotli = None
+
+
+def normalize(text):
+    """Приводит строку к виду для сравнения без учёта регистра и «ё»."""
+    return text.casefold().replace('ё', 'е').strip()
+
+
+class VersionedBuild(ABC):
+    """Данные в памяти процесса, перестраиваемые по версии в кэше.
+
+    Сигналы меняют версию через ``invalidate``, и при общем кэше данные
+    перестраивают все процессы при следующем обращении.
+    """
+    VERSION_KEY = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+
+    def invalidate(self):
+        try:
+            cache.incr(self.VERSION_KEY)
+        except ValueError:
+            cache.set(self.VERSION_KEY, 2, None)
+        self._version = None
+
+    @abstractmethod
+    def build(self):
+        """Перестраивает данные из базы; вызывается под блокировкой."""
+
+    def ensure_fresh(self):
+        version = cache.get_or_set(self.VERSION_KEY, 1, None)
+        if version == self._version:
+            return
+        # Сборку видят все запросы процесса, поэтому она читает основную базу
+        with self._lock, primary_reads():
+            if version != self._version:
+                self.build()
+                self._version = version
+
+
+class IngredientIndex(VersionedBuild):
+    """Отсортированный индекс ингредиентов в памяти процесса.
+
+    Поиск по префиксу выполняется двоичным поиском по нормализованным
+    названиям и не обращается к базе данных.
+    """
+    VERSION_KEY = 'ingredients:index-version'
+
+    def __init__(self):
+        super().__init__()
+        # Ключи и строки подменяются одним присваиванием, чтобы поиск без
+        # блокировки не взял ключи одной сборки и строки другой
+        self._data = ([], [])
+
+    def build(self):
+        rows = sorted(
+            (normalize(name), name, pk, unit)
+            for pk, name, unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        self._data = ([row[0] for row in rows], rows)
+
+    def search(self, prefix, limit=None):
+        """Ингредиенты, название которых начинается с prefix.
+
+        Точное совпадение идёт первым, затем более короткие названия,
+        затем по алфавиту.
+        """
+        self.ensure_fresh()
+        prefix = normalize(prefix)
+        keys, rows = self._data
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + '\U0010ffff', lo=start)
+        matches = sorted(
+            rows[start:end], key=lambda row: (row[0] != prefix, len(row[0]))
+        )
+        if limit is not None:
+            matches = matches[:limit]
+        return [
+            {'id': pk, 'name': name, 'measurement_unit': unit}
+            for _, name, pk, unit in matches
+        ]
+
+
+class IngredientCatalog(VersionedBuild):
+    """Полный список ингредиентов, заранее отрендеренный и сжатый.
+
+    Хранит JSON и его gzip/brotli-варианты со строгими ETag, так что
+    ответ на ``/api/ingredients/`` не сериализует таблицу заново.
+    """
+    VERSION_KEY = 'ingredients:catalog-version'
+
+    def __init__(self):
+        super().__init__()
+        self._variants = {}
+
+    def build(self):
+        from api.serializers import IngredientSerializer
+
+        body = JSONRenderer().render(IngredientSerializer(
+            Ingredient.objects.order_by('id'), many=True
+        ).data)
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        variants = {None: (body, f'"{digest}"')}
+        variants['gzip'] = (
+            gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gz"'
+        )
+        if brotli is not None:
+            variants['br'] = (brotli.compress(body), f'"{digest}-br"')
+        self._variants = variants
+
+    def choose_encoding(self, request):
+        accepted = {
+            part.split(';')[0].strip().lower()
+            for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(',')
+        }
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self._variants:
+                return encoding
+        return None
+
+    def response(self, request):
+        self.ensure_fresh()
+        encoding = self.choose_encoding(request)
+        body, etag = self._variants[encoding]
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+        known = {tag for _, tag in self._variants.values()}
+        requested = {tag.strip() for tag in if_none_match.split(',')}
+        if '*' in requested or requested & known:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type='application/json')
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class RecipeIngredientIndex(VersionedBuild):
+    """Битовые множества рецептов по ингредиентам в памяти процесса.
+
+    Для каждого ингредиента хранится целое число, в котором бит с номером
+    позиции рецепта установлен, если рецепт его содержит. Запросы «есть все»,
+    «есть любой», «без» и «всё из кладовой» сводятся к побитовым операциям
+    над этими числами.
+
+    Изменения отдельных рецептов применяются на месте и записываются в кэш
+    под новой версией, так что остальные процессы догоняют их одним
+    запросом к базе, а не перестройкой всего индекса.
+    """
+    VERSION_KEY = 'recipes:ingredient-bitset-version'
+    CHANGE_KEY = 'recipes:ingredient-bitset-change:{}'
+    # Сколько изменений можно догнать по журналу вместо перестройки
+    MAX_CHANGES = 500
+    CHANGE_TIMEOUT = 3600
+
+    def __init__(self):
+        super().__init__()
+        self._ids = []
+        self._positions = {}
+        self._ingredients = {}
+        self._postings = {}
+        self._all = 0
+        self._nonempty = 0
+
+    def build(self):
+        ids = list(Recipe.objects.order_by('id').values_list('id', flat=True))
+        positions = {recipe_id: position for position, recipe_id in
+                     enumerate(ids)}
+        size = len(ids) // 8 + 1
+        ingredients, bitmaps = {}, {}
+        nonempty = bytearray(size)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        ).order_by().iterator(chunk_size=10000):
+            position = positions.get(recipe_id)
+            if position is None:
+                continue
+            ingredients.setdefault(recipe_id, []).append(ingredient_id)
+            nonempty[position >> 3] |= 1 << (position & 7)
+            bitmap = bitmaps.get(ingredient_id)
+            if bitmap is None:
+                bitmap = bitmaps[ingredient_id] = bytearray(size)
+            bitmap[position >> 3] |= 1 << (position & 7)
+        self._ids = ids
+        self._positions = positions
+        self._ingredients = {
+            recipe_id: tuple(values) for recipe_id, values in
+            ingredients.items()
+        }
+        self._postings = {
+            ingredient_id: int.from_bytes(bitmap, 'little')
+            for ingredient_id, bitmap in bitmaps.items()
+        }
+        self._all = (1 << len(ids)) - 1
+        self._nonempty = int.from_bytes(nonempty, 'little')
+
+    def ensure_fresh(self):
+        version = cache.get_or_set(self.VERSION_KEY, 1, None)
+        if version == self._version:
+            return
+        with self._lock, primary_reads():
+            if version == self._version:
+                return
+            if not self.catch_up(version):
+                self.build()
+            self._version = version
+
+    def catch_up(self, version):
+        """Применяет журнал изменений; False, если нужна перестройка."""
+        if self._version is None or not (
+            0 < version - self._version <= self.MAX_CHANGES
+        ):
+            return False
+        keys = [
+            self.CHANGE_KEY.format(number)
+            for number in range(self._version + 1, version + 1)
+        ]
+        changes = cache.get_many(keys)
+        if len(changes) != len(keys):
+            return False
+        recipe_ids = set(changes.values())
+        existing = set(Recipe.objects.filter(
+            id__in=recipe_ids
+        ).values_list('id', flat=True))
+        ingredients = {recipe_id: [] for recipe_id in existing}
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+            recipe_id__in=existing
+        ).values_list('recipe_id', 'ingredient_id'):
+            ingredients[recipe_id].append(ingredient_id)
+        for recipe_id in recipe_ids:
+            self.apply(recipe_id, ingredients.get(recipe_id))
+        return True
+
+    def apply(self, recipe_id, ingredient_ids):
+        """Обновляет рецепт в индексе; None означает, что рецепт удалён."""
+        position = self._positions.get(recipe_id)
+        if position is None:
+            if ingredient_ids is None:
+                return
+            position = self._positions[recipe_id] = len(self._ids)
+            self._ids.append(recipe_id)
+        bit = 1 << position
+        for ingredient_id in self._ingredients.pop(recipe_id, ()):
+            self._postings[ingredient_id] &= ~bit
+        self._nonempty &= ~bit
+        if ingredient_ids is None:
+            self._all &= ~bit
+            return
+        self._all |= bit
+        if ingredient_ids:
+            self._nonempty |= bit
+        self._ingredients[recipe_id] = tuple(ingredient_ids)
+        for ingredient_id in ingredient_ids:
+            self._postings[ingredient_id] = (
+                self._postings.get(ingredient_id, 0) | bit
+            )
+
+    def update_recipe(self, recipe_id, ingredient_ids=None):
+        """Записывает изменение рецепта; ingredient_ids=None — рецепт удалён.
+
+        Без ingredient_ids для существующего рецепта состав читается из базы.
+        """
+        if ingredient_ids is None and Recipe.objects.filter(
+            pk=recipe_id
+        ).exists():
+            ingredient_ids = list(RecipeIngredient.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('ingredient_id', flat=True))
+        try:
+            version = cache.incr(self.VERSION_KEY)
+        except ValueError:
+            self.invalidate()
+            return
+        cache.set(self.CHANGE_KEY.format(version), recipe_id,
+                  self.CHANGE_TIMEOUT)
+        with self._lock:
+            if self._version == version - 1:
+                self.apply(recipe_id, ingredient_ids)
+                self._version = version
+
+    def update_on_commit(self, recipe_id, ingredient_ids=None):
+        """update_recipe после фиксации транзакции.
+
+        Откаченная запись не попадает в индекс. count списков, посчитанные
+        до обновления индекса, сбрасываются.
+        """
+        def apply():
+            self.update_recipe(recipe_id, ingredient_ids)
+            invalidate_counts()
+        transaction.on_commit(apply)
+
+    def remove_recipe(self, recipe_id):
+        self.update_recipe(recipe_id, None)
+
+    def match(self, has_all=(), has_any=(), exclude=(), pantry=None):
+        """id рецептов, подходящих под условия по ингредиентам.
+
+        has_all — рецепт содержит все ингредиенты, has_any — хотя бы один,
+        exclude — ни одного, pantry — все ингредиенты рецепта входят в набор.
+        """
+        self.ensure_fresh()
+        postings, result = self._postings, self._all
+        for ingredient_id in has_all:
+            result &= postings.get(ingredient_id, 0)
+        if has_any:
+            result &= reduce(
+                or_, (postings.get(i, 0) for i in has_any), 0
+            )
+        if exclude:
+            result &= ~reduce(
+                or_, (postings.get(i, 0) for i in exclude), 0
+            )
+        if pantry is not None:
+            pantry = set(pantry)
+            # Рецепт подходит, если в нём нет ни одного ингредиента вне
+            # кладовой; рецепты без ингредиентов не подходят
+            result &= self._nonempty & ~reduce(or_, (
+                posting for ingredient_id, posting in postings.items()
+                if ingredient_id not in pantry
+            ), 0)
+        ids = self._ids
+        return [
+            ids[found.start()]
+            for found in re.finditer('1', bin(result)[:1:-1])
+        ]
+
+
+class TagCatalog(VersionedBuild):
+    """Теги в памяти процесса.
+
+    Рецепт хранит свои теги маской Recipe.tag_mask, и список тегов для
+    ответа собирается по ней без JOIN и prefetch.
+    """
+    VERSION_KEY = 'tags:catalog-version'
+
+    def __init__(self):
+        super().__init__()
+        self._tags = []
+        self._masks = {}
+
+    def build(self):
+        tags = list(Tag.objects.order_by('id'))
+        self._tags = [
+            (tag.mask, {'id': tag.id, 'name': tag.name, 'slug': tag.slug})
+            for tag in tags
+        ]
+        self._masks = {tag.slug: tag.mask for tag in tags}
+
+    def all(self):
+        self.ensure_fresh()
+        return [data for _, data in self._tags]
+
+    def snapshot(self):
+        """Актуальные теги как (маска, данные) для разбора многих рецептов."""
+        self.ensure_fresh()
+        return self._tags
+
+    def mask_for(self, slugs):
+        """Маска тегов по slug; неизвестные slug пропускаются."""
+        self.ensure_fresh()
+        mask = 0
+        for slug in slugs:
+            mask |= self._masks.get(slug, 0)
+        return mask
+
+
+ingredient_index = IngredientIndex()
+ingredient_catalog = IngredientCatalog()
+recipe_ingredient_index = RecipeIngredientIndex()
+tag_catalog = TagCatalog()
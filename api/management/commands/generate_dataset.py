@@ -0,0 +1,243 @@
+import random
+import time
+from datetime import timedelta
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from api import feed, popularity, search, shopping_list
+from api.indexes import recipe_ingredient_index
+from api.models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient, ShoppingCart, Tag
+)
+from core.pagination import invalidate_counts
+from users.models import Subscription, User
+
+FIRST_NAMES = (
+    'Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Сергей', 'Елена', 'Дмитрий',
+    'Наталья', 'Алексей', 'Татьяна', 'Андрей', 'Ирина', 'Михаил', 'Светлана',
+)
+LAST_NAMES = (
+    'Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров',
+    'Соколов', 'Михайлов', 'Новиков', 'Фёдоров', 'Морозов', 'Волков',
+)
+DISHES = (
+    'Суп', 'Салат', 'Пирог', 'Рагу', 'Запеканка', 'Каша', 'Омлет', 'Плов',
+    'Борщ', 'Блины', 'Котлеты', 'Паста', 'Ризотто', 'Оладьи', 'Жаркое',
+)
+STYLES = (
+    'домашний', 'по-деревенски', 'с травами', 'пикантный', 'быстрый',
+    'праздничный', 'бабушкин', 'летний', 'зимний', 'постный', 'острый',
+)
+TAGS = (
+    ('Завтрак', 'breakfast'), ('Обед', 'lunch'), ('Ужин', 'dinner'),
+    ('Десерт', 'dessert'), ('Вегетарианское', 'vegetarian'),
+)
+IMAGE_NAME = 'recipes/synthetic.png'
+PASSWORD = 'synthetic-password'
+
+
+def skewed_index(rng, size, skew=3):
+    """Индекс со смещением к началу: первые объекты «популярнее»."""
+    return int(size * rng.random() ** skew)
+
+
+def batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт синтетический набор пользователей, рецептов, избранного, '
+        'корзин и подписок заданного размера'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, nargs=2, default=(3, 12),
+            metavar=('MIN', 'MAX')
+        )
+        parser.add_argument('--favorites', type=int, default=100000)
+        parser.add_argument('--carts', type=int, default=10000)
+        parser.add_argument('--subscriptions', type=int, default=10000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = f'synthetic{int(time.time())}'
+        if not Ingredient.objects.exists():
+            call_command('load_ingredients', stdout=self.stdout)
+        self.ingredient_ids = list(
+            Ingredient.objects.values_list('id', flat=True)
+        )
+        if not self.ingredient_ids:
+            raise CommandError('Нет ингредиентов для рецептов')
+        self.ensure_image()
+        self.tags = self.ensure_tags()
+
+        started = time.perf_counter()
+        user_ids = self.step('пользователи', self.create_users,
+                             options['users'])
+        recipe_ids = self.step('рецепты', self.create_recipes,
+                               options['recipes'], user_ids)
+        self.step('ингредиенты рецептов', self.create_recipe_ingredients,
+                  recipe_ids, *options['ingredients_per_recipe'])
+        self.step('избранное', self.create_pairs, Favorite, 'recipe_id',
+                  options['favorites'], user_ids, recipe_ids)
+        self.step('корзины', self.create_pairs, ShoppingCart, 'recipe_id',
+                  options['carts'], user_ids, recipe_ids)
+        self.step('подписки', self.create_pairs, Subscription, 'author_id',
+                  options['subscriptions'], user_ids, user_ids)
+
+        # bulk_create не отправляет сигналы, поэтому производные данные
+        # пересчитываются явно
+        self.step('списки покупок', shopping_list.rebuild)
+        self.step('поисковый индекс', search.rebuild)
+        self.step('счётчики', call_command, 'reconcile_counters',
+                  stdout=self.stdout)
+        self.step('популярность', popularity.refresh, full=True)
+        # Лента собирается после сверки: порог смотрит на recipes_count
+        self.step('лента подписок', feed.rebuild)
+        recipe_ingredient_index.invalidate()
+        invalidate_counts()
+        self.stdout.write(self.style.SUCCESS(
+            f'Набор данных создан за {time.perf_counter() - started:.1f} с. '
+            f'Пароль пользователей: {PASSWORD}'
+        ))
+
+    def step(self, title, function, *args, **kwargs):
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.stdout.write(
+            f'{title}: {time.perf_counter() - started:.1f} с'
+        )
+        return result
+
+    def ensure_image(self):
+        if default_storage.exists(IMAGE_NAME):
+            return
+        buffer = BytesIO()
+        Image.new('RGB', (640, 480), (200, 160, 120)).save(buffer, 'PNG')
+        default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+
+    def ensure_tags(self):
+        tags = [
+            Tag.objects.get_or_create(slug=slug, defaults={'name': name})[0]
+            for name, slug in TAGS
+        ]
+        return [(tag.id, tag.mask) for tag in tags]
+
+    def create_users(self, count):
+        password = make_password(PASSWORD)
+        users = (
+            User(
+                username=f'{self.prefix}_{i}',
+                email=f'{self.prefix}_{i}@example.com',
+                first_name=self.rng.choice(FIRST_NAMES),
+                last_name=self.rng.choice(LAST_NAMES),
+                password=password,
+            )
+            for i in range(count)
+        )
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        return list(User.objects.filter(
+            username__startswith=f'{self.prefix}_'
+        ).values_list('id', flat=True))
+
+    def create_recipes(self, count, author_ids):
+        if not author_ids:
+            raise CommandError('Для рецептов нужен хотя бы один пользователь')
+        now = timezone.now()
+        recipe_ids = []
+        recipe_tags = Recipe.tags.through
+        for start in range(0, count, self.batch_size):
+            chosen = [
+                self.rng.sample(self.tags, self.rng.randint(0, 2))
+                for _ in range(min(self.batch_size, count - start))
+            ]
+            recipes = [
+                Recipe(
+                    author_id=author_ids[
+                        skewed_index(self.rng, len(author_ids))
+                    ],
+                    name=(f'{self.rng.choice(DISHES)} '
+                          f'{self.rng.choice(STYLES)} №{start + i}'),
+                    text='Синтетический рецепт для нагрузочного тестирования.',
+                    cooking_time=self.rng.randint(5, 180),
+                    image=IMAGE_NAME,
+                    tag_mask=sum(mask for _, mask in tags),
+                )
+                for i, tags in enumerate(chosen)
+            ]
+            with transaction.atomic():
+                Recipe.objects.bulk_create(recipes)
+                # pub_date заполняется auto_now_add, поэтому даты
+                # публикации разносятся по последнему году отдельно
+                for recipe in recipes:
+                    recipe.pub_date = now - timedelta(
+                        seconds=self.rng.randint(0, 365 * 24 * 3600)
+                    )
+                Recipe.objects.bulk_update(
+                    recipes, ['pub_date'], batch_size=500
+                )
+                recipe_tags.objects.bulk_create(
+                    recipe_tags(recipe_id=recipe.id, tag_id=tag_id)
+                    for recipe, tags in zip(recipes, chosen)
+                    for tag_id, _ in tags
+                )
+            recipe_ids.extend(recipe.id for recipe in recipes)
+        return recipe_ids
+
+    def create_recipe_ingredients(self, recipe_ids, minimum, maximum):
+        maximum = min(maximum, len(self.ingredient_ids))
+        minimum = min(minimum, maximum)
+        for chunk in batches(recipe_ids, self.batch_size // maximum or 1):
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe_id=recipe_id, ingredient_id=ingredient_id,
+                    amount=self.rng.randint(1, 500)
+                )
+                for recipe_id in chunk
+                for ingredient_id in self.rng.sample(
+                    self.ingredient_ids, self.rng.randint(minimum, maximum)
+                )
+            )
+
+    def create_pairs(self, model, target_field, count, user_ids, target_ids):
+        """Случайные пары пользователь — объект без повторов.
+
+        Популярные объекты выбираются чаще; повторные пары отбрасываются
+        ограничением уникальности. Избранное и корзины получают даты
+        добавления за последние три месяца.
+        """
+        if not user_ids or not target_ids:
+            return
+        now = timezone.now()
+        dated = model is not Subscription
+        for start in range(0, count, self.batch_size):
+            pairs = set()
+            for _ in range(min(self.batch_size, count - start)):
+                user_id = self.rng.choice(user_ids)
+                target_id = target_ids[skewed_index(self.rng, len(target_ids))]
+                if model is not Subscription or user_id != target_id:
+                    pairs.add((user_id, target_id))
+            model.objects.bulk_create(
+                (model(user_id=user_id, **{target_field: target_id},
+                       **({'created_at': now - timedelta(
+                           seconds=self.rng.randint(0, 90 * 24 * 3600)
+                       )} if dated else {}))
+                 for user_id, target_id in pairs),
+                ignore_conflicts=True
+            )
@@ -0,0 +1,150 @@
+import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.constants import OnConflict
+
+from api.indexes import ingredient_catalog, ingredient_index
+from api.models import Ingredient
+
+CHUNK_SIZE = 1 << 16
+SEPARATORS = ' \t\r\n,'
+
+
+def iter_json_array(file):
+    """Объекты из JSON-массива по одному, без чтения файла целиком."""
+    decoder = json.JSONDecoder()
+    buffer, position = '', 0
+    started = eof = False
+    number = 0
+    while True:
+        while position < len(buffer) and buffer[position] in SEPARATORS:
+            position += 1
+        if position >= len(buffer):
+            if eof:
+                raise CommandError('Неожиданный конец JSON-файла')
+            chunk = file.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        if not started:
+            if buffer[position] != '[':
+                raise CommandError('Ожидался JSON-массив ингредиентов')
+            started = True
+            position += 1
+            continue
+        if buffer[position] == ']':
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise CommandError('Некорректный JSON')
+            chunk = file.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        number += 1
+        try:
+            name, unit = item['name'], item['measurement_unit']
+        except (KeyError, TypeError):
+            raise CommandError(
+                f'Элемент {number}: ожидались поля name и measurement_unit'
+            )
+        yield name, unit
+
+
+def iter_csv(file):
+    reader = csv.reader(file)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < 2:
+            raise CommandError(
+                f'Строка {reader.line_num}: ожидались название и единица '
+                f'измерения'
+            )
+        yield row[0], row[1]
+
+
+def insert_statement(connection):
+    """INSERT, пропускающий дубли по ограничению уникальности."""
+    ops = connection.ops
+    table = ops.quote_name(Ingredient._meta.db_table)
+    columns = ', '.join(
+        ops.quote_name(Ingredient._meta.get_field(name).column)
+        for name in ('name', 'measurement_unit')
+    )
+    return ' '.join(part for part in (
+        ops.insert_statement(on_conflict=OnConflict.IGNORE),
+        f'{table} ({columns}) VALUES (%s, %s)',
+        ops.on_conflict_suffix_sql([], OnConflict.IGNORE, [], []),
+    ) if part)
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из JSON или CSV пачками, пропуская дубли'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            default=str(Path(settings.BASE_DIR) / 'data' / 'ingredients.json'),
+            help='Файл с ингредиентами (.json или .csv)'
+        )
+        parser.add_argument(
+            '--format', choices=('json', 'csv'),
+            help='Формат файла; по умолчанию определяется по расширению'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        readers = {'json': iter_json_array, 'csv': iter_csv}
+        if file_format not in readers:
+            raise CommandError(f'Неизвестный формат файла: {path.name}')
+        if not path.exists():
+            raise CommandError(f'Файл не найден: {path}')
+
+        database = options['database']
+        batch_size = options['batch_size']
+        connection = connections[database]
+        manager = Ingredient.objects.using(database)
+        before = manager.count()
+        started = time.perf_counter()
+        total = 0
+        # executemany с готовым INSERT вместо bulk_create: без создания
+        # объектов моделей и компиляции запроса на каждую пачку загрузка
+        # в несколько раз быстрее
+        sql = insert_statement(connection)
+        with path.open(encoding='utf-8', newline='') as file, \
+                transaction.atomic(using=database), \
+                connection.cursor() as cursor:
+            rows = readers[file_format](file)
+            while True:
+                batch = [
+                    (name.strip(), unit.strip())
+                    for name, unit in islice(rows, batch_size)
+                ]
+                if not batch:
+                    break
+                cursor.executemany(sql, batch)
+                total += len(batch)
+        elapsed = time.perf_counter() - started
+        created = manager.count() - before
+
+        # Вставка мимо ORM не отправляет сигналы, сбрасываем индексы вручную
+        ingredient_index.invalidate()
+        ingredient_catalog.invalidate()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано {total}, добавлено {created}, '
+            f'пропущено {total - created} за {elapsed:.2f} с '
+            f'({total / elapsed if elapsed else total:.0f} строк/с)'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api import shopping_list
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает списки покупок по содержимому корзин'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='user_ids',
+            help='id пользователя; можно указать несколько раз'
+        )
+
+    def handle(self, *args, **options):
+        shopping_list.rebuild(options['user_ids'])
+        self.stdout.write(self.style.SUCCESS('Списки покупок пересчитаны'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Favorite, Recipe, ShoppingCart
+from core.counters import reconcile
+from users.models import Subscription, User
+
+# Модель и поле счётчика, модель и поле связанных строк
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscription, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет счётчики избранного, корзин, рецептов и подписчиков с '
+        'фактическими данными и исправляет расхождения'
+    )
+
+    def handle(self, *args, **options):
+        for model, field, related_model, related_field in COUNTERS:
+            fixed = reconcile(model, field, related_model, related_field)
+            self.stdout.write(
+                f'{model._meta.model_name}.{field}: исправлено {fixed}'
+            )
+        self.stdout.write(self.style.SUCCESS('Счётчики сверены'))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import popularity
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает оценки популярности рецептов для ?ordering=popular '
+        'и ?ordering=trending; рассчитана на запуск по расписанию'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать все рецепты, а не только изменившиеся'
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = popularity.refresh(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано рецептов: {count} за '
+            f'{time.perf_counter() - started:.2f} с'
+        ))
@@ -0,0 +1,287 @@
+import json
+import math
+import random
+import re
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from api.models import Ingredient, Recipe
+from users.models import User
+
+VARIABLE = re.compile(r'{{\s*(\w+)\s*}}')
+# Переменные коллекции Postman, которые подставляются из базы
+ALIASES = {
+    'firstRecipeId': 'recipeId',
+    'firstIndredientId': 'ingredientId',
+    'ingredientNameFirstLatter': 'ingredientPrefix',
+}
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу; values должен быть отсортирован."""
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+
+def read_jsonl(path):
+    """Сценарии из JSONL: одна строка — один запрос.
+
+    Поля: path (обязательно), method, auth, body, weight и name. Строки без
+    path пропускаются.
+    """
+    scenarios = []
+    with path.open(encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if 'path' not in item:
+                continue
+            method = item.get('method', 'GET').upper()
+            auth = bool(item.get('auth', False))
+            scenarios.append({
+                'name': item.get('name') or describe(
+                    method, item['path'], auth
+                ),
+                'method': method,
+                'path': item['path'],
+                'auth': auth,
+                'body': item.get('body'),
+                'weight': item.get('weight', 1),
+            })
+    return scenarios
+
+
+def read_postman(path):
+    """GET-запросы из коллекции Postman.
+
+    Изменяющие запросы пропускаются: коллекция рассчитана на пустую базу и
+    на переменные, которые выставляют её тестовые скрипты.
+    """
+    with path.open(encoding='utf-8') as file:
+        collection = json.load(file)
+    scenarios = []
+
+    def walk(items, auth):
+        for item in items:
+            item_auth = (
+                item.get('auth') or item.get('request', {}).get('auth') or auth
+            )
+            if 'item' in item:
+                walk(item['item'], item_auth)
+                continue
+            request = item['request']
+            if request['method'] != 'GET':
+                continue
+            url = request['url']
+            url = url['raw'] if isinstance(url, dict) else url
+            url = url.replace('{{baseUrl}}', '')
+            authenticated = (item_auth or {}).get('type') == 'apikey'
+            scenarios.append({
+                'name': describe('GET', url, authenticated),
+                'method': 'GET',
+                'path': url,
+                'auth': authenticated,
+                'body': None,
+                'weight': 1,
+            })
+
+    walk(collection.get('item', []), collection.get('auth'))
+    return scenarios
+
+
+def describe(method, path, auth):
+    return f'{method} {path}' + (' [auth]' if auth else '')
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогоняет сценарии запросов к API внутри процесса и выводит '
+        'задержки, пропускную способность и число SQL-запросов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios', nargs='*',
+            help='Файлы сценариев: .jsonl или коллекция Postman (.json)'
+        )
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument(
+            '--viewers', type=int, default=20,
+            help='Сколько пользователей выполняют авторизованные запросы'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', help='Сохранить результаты в файл')
+
+    def handle(self, *args, **options):
+        paths = options['scenarios'] or [
+            Path(settings.BASE_DIR) / 'data' / 'load_scenarios.jsonl'
+        ]
+        scenarios = []
+        for path in map(Path, paths):
+            if not path.exists():
+                raise CommandError(f'Файл не найден: {path}')
+            reader = read_jsonl if path.suffix == '.jsonl' else read_postman
+            scenarios.extend(reader(path))
+        if not scenarios:
+            raise CommandError('В файлах нет сценариев запросов')
+
+        self.rng = random.Random(options['seed'])
+        self.load_variables(options['viewers'])
+        scenarios = [
+            scenario for scenario in scenarios
+            if all(
+                ALIASES.get(name, name) in self.variables
+                for name in VARIABLE.findall(scenario['path'])
+            )
+        ]
+        if not scenarios:
+            raise CommandError(
+                'Не удалось подставить переменные ни в один сценарий; '
+                'создайте данные командой generate_dataset'
+            )
+        weights = [scenario['weight'] for scenario in scenarios]
+
+        self.client = Client()
+        for scenario in self.rng.choices(
+            scenarios, weights, k=options['warmup']
+        ):
+            self.perform(scenario)
+
+        samples = defaultdict(list)
+        started = time.perf_counter()
+        for scenario in self.rng.choices(
+            scenarios, weights, k=options['requests']
+        ):
+            samples[scenario['name']].append(self.perform(scenario))
+        elapsed = time.perf_counter() - started
+
+        report = self.summarize(samples, elapsed)
+        self.print_report(report)
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+    def load_variables(self, viewers):
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True)[:10000])
+        user_ids = list(User.objects.values_list('id', flat=True)[:10000])
+        ingredients = list(
+            Ingredient.objects.values_list('id', 'name')[:10000]
+        )
+        # Авторизованные запросы идут от пользователей с корзинами и
+        # подписками, чтобы список покупок и подписки не были пустыми
+        viewer_ids = list(User.objects.filter(
+            shopping_cart__isnull=False, follower__isnull=False
+        ).values_list('id', flat=True).distinct()[:viewers]) or user_ids[
+            :viewers
+        ]
+        self.tokens = [
+            Token.objects.get_or_create(user_id=user_id)[0].key
+            for user_id in viewer_ids
+        ]
+        self.variables = {}
+        if recipe_ids:
+            self.variables['recipeId'] = recipe_ids
+        if user_ids:
+            self.variables['userId'] = user_ids
+        if ingredients:
+            self.variables['ingredientId'] = [pk for pk, _ in ingredients]
+            self.variables['ingredientPrefix'] = [
+                name[:2] for _, name in ingredients
+            ]
+        if self.tokens:
+            self.variables['userToken'] = self.tokens
+
+    def perform(self, scenario):
+        path = VARIABLE.sub(
+            lambda match: str(self.rng.choice(
+                self.variables[ALIASES.get(match[1], match[1])]
+            )),
+            scenario['path']
+        )
+        headers = {}
+        if scenario['auth'] and self.tokens:
+            headers['HTTP_AUTHORIZATION'] = (
+                f'Token {self.rng.choice(self.tokens)}'
+            )
+        kwargs = {}
+        if scenario['body'] is not None:
+            kwargs = {
+                'data': json.dumps(scenario['body']),
+                'content_type': 'application/json',
+            }
+        request = getattr(self.client, scenario['method'].lower())
+        with ExitStack() as stack:
+            contexts = [
+                stack.enter_context(CaptureQueriesContext(connection))
+                for connection in connections.all()
+            ]
+            started = time.perf_counter()
+            response = request(path, **kwargs, **headers)
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+            duration = time.perf_counter() - started
+        return {
+            'duration': duration,
+            'queries': sum(len(context) for context in contexts),
+            'error': response.status_code >= 500,
+            'status': response.status_code,
+        }
+
+    def summarize(self, samples, elapsed):
+        endpoints = []
+        for name, items in sorted(samples.items()):
+            durations = sorted(item['duration'] for item in items)
+            queries = [item['queries'] for item in items]
+            endpoints.append({
+                'name': name,
+                'requests': len(items),
+                'errors': sum(item['error'] for item in items),
+                'statuses': sorted({item['status'] for item in items}),
+                'p50_ms': percentile(durations, 50) * 1000,
+                'p95_ms': percentile(durations, 95) * 1000,
+                'p99_ms': percentile(durations, 99) * 1000,
+                # Доля эндпоинта в общем потоке за то же окно прогона
+                'rps': len(items) / elapsed if elapsed else 0,
+                'queries_avg': sum(queries) / len(queries),
+                'queries_max': max(queries),
+            })
+        total = sum(len(items) for items in samples.values())
+        return {
+            'requests': total,
+            'elapsed': elapsed,
+            'rps': total / elapsed if elapsed else 0,
+            'endpoints': endpoints,
+        }
+
+    def print_report(self, report):
+        header = (
+            f'{"Эндпоинт":<60} {"N":>5} {"5xx":>4} {"p50":>8} {"p95":>8} '
+            f'{"p99":>8} {"rps":>8} {"SQL":>6} {"SQLmax":>6}'
+        )
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in report['endpoints']:
+            self.stdout.write(
+                f'{row["name"][:60]:<60} {row["requests"]:>5} '
+                f'{row["errors"]:>4} {row["p50_ms"]:>8.1f} '
+                f'{row["p95_ms"]:>8.1f} {row["p99_ms"]:>8.1f} '
+                f'{row["rps"]:>8.1f} {row["queries_avg"]:>6.1f} '
+                f'{row["queries_max"]:>6}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Всего {report["requests"]} запросов за '
+            f'{report["elapsed"]:.2f} с ({report["rps"]:.1f} запросов/с), '
+            'время в миллисекундах'
+        ))
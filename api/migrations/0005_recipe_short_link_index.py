@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='short_link',
+            field=models.URLField(blank=True, db_index=True, null=True, verbose_name='Короткая ссылка'),
+        ),
+    ]
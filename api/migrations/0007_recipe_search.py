@@ -0,0 +1,66 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:04
+
+import api.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_search_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            'CREATE VIRTUAL TABLE api_recipe_search USING fts5('
+            "name, text, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        # Совпадение в названии весит в десять раз больше, чем в описании
+        cursor.execute(
+            'INSERT INTO api_recipe_search (api_recipe_search, rank) '
+            "VALUES ('rank', 'bm25(10.0, 1.0)')"
+        )
+        Recipe = apps.get_model('api', 'Recipe')
+        cursor.executemany(
+            'INSERT INTO api_recipe_search (rowid, name, text) '
+            'VALUES (%s, %s, %s)',
+            [
+                (pk, *(
+                    value.casefold().replace('ё', 'е').strip()
+                    for value in (name, text)
+                ))
+                for pk, name, text in Recipe.objects.values_list(
+                    'id', 'name', 'text'
+                ).iterator()
+            ]
+        )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS api_recipe_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeSearch',
+            fields=[
+                ('recipe', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='api.recipe')),
+                ('document', api.models.SearchDocumentField(db_column='api_recipe_search')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'api_recipe_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
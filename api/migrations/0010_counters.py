@@ -0,0 +1,45 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+from core.counters import reconcile
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('api', 'Recipe')
+    User = apps.get_model('users', 'User')
+    reconcile(Recipe, 'favorites_count', apps.get_model('api', 'Favorite'),
+              'recipe')
+    reconcile(Recipe, 'in_carts_count',
+              apps.get_model('api', 'ShoppingCart'), 'recipe')
+    reconcile(User, 'recipes_count', Recipe, 'author')
+    reconcile(User, 'subscribers_count',
+              apps.get_model('users', 'Subscription'), 'author')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_updated_at'),
+        ('users', '0004_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-id'], name='recipe_favorites_count_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -1,21 +1,42 @@
 # models.py
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.utils import timezone
 from users.models import User
-from django.db.models.signals import pre_save
-from django.dispatch import receiver
-from django.conf import settings
-import secrets
-import string
+from core.counters import save_without_counters
+from core.utils import decode_short_code, encode_short_code
 
 
 class Tag(models.Model):
+    # Маска тегов рецепта хранится в знаковом 64-битном целом
+    MAX_TAGS = 63
+
     name = models.CharField(max_length=50, unique=True)
     slug = models.SlugField(max_length=50, unique=True)
+    bit = models.PositiveSmallIntegerField(
+        'Бит в маске рецепта', unique=True, editable=False
+    )
 
     def __str__(self):
         return self.name
 
+    @property
+    def mask(self):
+        return 1 << self.bit
+
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            used = set(Tag.objects.values_list('bit', flat=True))
+            free = [bit for bit in range(self.MAX_TAGS) if bit not in used]
+            if not free:
+                raise ValidationError(
+                    f'Нельзя создать больше {self.MAX_TAGS} тегов'
+                )
+            self.bit = free[0]
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Тег'
         verbose_name_plural = 'Теги'
@@ -48,6 +69,19 @@ class Recipe(models.Model):
     )
     name = models.CharField('Название', max_length=200)
     image = models.ImageField('Изображение', upload_to='recipes/')
+    tags = models.ManyToManyField(
+        Tag,
+        related_name='recipes',
+        verbose_name='Теги',
+        blank=True
+    )
+    # Сумма Tag.mask тегов рецепта; поддерживается сигналом m2m_changed
+    tag_mask = models.BigIntegerField(
+        'Маска тегов', default=0, editable=False
+    )
+    image_variants = models.JSONField(
+        'Варианты изображения', default=dict, blank=True, editable=False
+    )
     text = models.TextField('Описание')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -59,34 +93,110 @@ class Recipe(models.Model):
         validators=[MinValueValidator(1)]
     )
     pub_date = models.DateTimeField('Дата публикации', auto_now_add=True)
-    short_link = models.URLField('Короткая ссылка', blank=True, null=True)
+    # Меняется при сохранении рецепта, его ингредиентов и тегов и служит
+    # валидатором для условных GET
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+    # Счётчики меняются сигналами через F() и сверяются командой
+    # reconcile_counters
+    favorites_count = models.PositiveIntegerField(
+        'В избранном', default=0, editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'В корзинах', default=0, editable=False
+    )
+    # Оценки популярности с затуханием пересчитывает refresh_popularity
+    # для рецептов, у которых engagement_at позже scored_at
+    popular_score = models.FloatField(
+        'Популярность', default=0, editable=False
+    )
+    trending_score = models.FloatField(
+        'Популярность за последние дни', default=0, editable=False
+    )
+    engagement_at = models.DateTimeField(
+        'Изменение избранного и корзин', null=True, blank=True,
+        editable=False, db_index=True
+    )
+    scored_at = models.DateTimeField(
+        'Расчёт популярности', null=True, blank=True, editable=False
+    )
+    # Заполнено только у старых рецептов со случайными кодами
+    short_link = models.URLField(
+        'Короткая ссылка', blank=True, null=True, db_index=True
+    )
 
     DOMAIN = 'http://127.0.0.1/'  # Замени на свой домен
+    COUNTERS = ('favorites_count', 'in_carts_count')
+    DERIVED_FIELDS = (
+        *COUNTERS, 'popular_score', 'trending_score', 'engagement_at',
+        'scored_at'
+    )
 
-    def save(self, *args, **kwargs):
-        if not self.short_link:
-            self.short_link = self.generate_short_link()
-        super().save(*args, **kwargs)
-
-    @classmethod
-    def generate_short_link(cls):
-        characters = string.ascii_letters + string.digits
-        for _ in range(100):  # Попробует до 10 раз создать уникальный код
-            short_code = ''.join(secrets.choice(characters) for _ in range(8))
-            link = f"{cls.DOMAIN}{short_code}"
-            if not Recipe.objects.filter(short_link=link).exists():
-                return link
-        raise Exception("Не удалось сгенерировать уникальную короткую ссылку")
+    def get_short_link(self):
+        """Короткая ссылка: сохранённая старая или вычисленная по id."""
+        if self.short_link:
+            return self.short_link
+        return f'{self.DOMAIN}s/{encode_short_code(self.pk)}/'
 
+    def short_codes(self):
+        """Все коды, по которым открывается рецепт."""
+        codes = [encode_short_code(self.pk)]
+        if self.short_link:
+            codes.append(self.short_link.rstrip('/').rsplit('/', 1)[-1])
+        return codes
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_favorites_count_idx'
+            ),
+            models.Index(
+                fields=['-popular_score', '-id'],
+                name='recipe_popular_score_idx'
+            ),
+            models.Index(
+                fields=['-trending_score', '-id'],
+                name='recipe_trending_score_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        save_without_counters(self, kwargs)
+        super().save(*args, **kwargs)
+
+
+def short_code_key(code):
+    return f'recipes:short-code:{code}'
+
+
+def resolve_short_code(code):
+    """id рецепта по короткому коду, в том числе по старому случайному.
+
+    Найденный id хранится в общем кэше, чтобы удаление рецепта сбрасывало
+    его во всех процессах. Ненайденный код вызывает Recipe.DoesNotExist и
+    не кэшируется, поэтому созданный позже рецепт найдётся.
+    """
+    key = short_code_key(code)
+    recipe_id = cache.get(key)
+    if recipe_id is not None:
+        return recipe_id
+    recipe_id = decode_short_code(code)
+    if recipe_id is None or not Recipe.objects.filter(pk=recipe_id).exists():
+        recipe_id = Recipe.objects.values_list('pk', flat=True).get(
+            short_link=f'{Recipe.DOMAIN}{code}'
+        )
+    cache.set(key, recipe_id, None)
+    return recipe_id
+
 
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(
@@ -133,6 +243,7 @@ class Favorite(models.Model):
         related_name='favorited_by',
         verbose_name='Рецепт'
     )
+    created_at = models.DateTimeField('Дата добавления', default=timezone.now)
 
     class Meta:
         verbose_name = 'Избранное'
@@ -161,6 +272,7 @@ class ShoppingCart(models.Model):
         related_name='in_shopping_cart',
         verbose_name='Рецепт'
     )
+    created_at = models.DateTimeField('Дата добавления', default=timezone.now)
 
     class Meta:
         verbose_name = 'Корзина покупок'
@@ -173,4 +285,127 @@ class ShoppingCart(models.Model):
         ]
 
     def __str__(self):
-        return f'{self.recipe} в корзине у {self.user}'
\ No newline at end of file
+        return f'{self.recipe} в корзине у {self.user}'
+
+
+# Счётчик рецепта для каждой модели добавлений
+ENGAGEMENT_COUNTERS = {
+    Favorite: 'favorites_count', ShoppingCart: 'in_carts_count'
+}
+
+
+class ShoppingListItem(models.Model):
+    """Суммарное количество ингредиента в корзине пользователя.
+
+    Поддерживается сигналами корзины и изменениями ингредиентов рецептов,
+    поэтому список покупок читается одним запросом.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Список покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} — {self.amount} у {self.user}'
+
+
+class FeedEntry(models.Model):
+    """Рецепт автора во входящих подписчика для ленты /api/users/feed/.
+
+    Строки создаются при публикации рецепта и при подписке; рецепты
+    авторов с числом рецептов больше FEED_FANOUT_MAX_RECIPES сюда не
+    попадают и подмешиваются при чтении.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_entry_user_pub_date_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
+
+
+class SearchDocumentField(models.TextField):
+    """Скрытый столбец FTS5 с именем таблицы, к которому применяют MATCH."""
+
+
+@SearchDocumentField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class RecipeSearch(models.Model):
+    """Строка полнотекстового индекса рецептов (виртуальная таблица FTS5).
+
+    Таблица существует только в SQLite и заполняется сигналами рецептов,
+    поэтому модель не управляется миграциями Django.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        db_constraint=False,
+        related_name='search_entry'
+    )
+    document = SearchDocumentField(db_column='api_recipe_search')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'api_recipe_search'
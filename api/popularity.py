@@ -0,0 +1,93 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from api.models import Favorite, Recipe, ShoppingCart
+
+# Период полураспада вклада одного добавления для каждой оценки
+HALF_LIVES = {
+    'popular_score': timedelta(days=30),
+    'trending_score': timedelta(days=2),
+}
+# Добавление в корзину значит, что рецепт собираются готовить
+WEIGHTS = {Favorite: 1.0, ShoppingCart: 2.0}
+# Оценки хранятся как логарифм суммы вкладов, приведённых к EPOCH:
+# log Σ w·exp(λ·(t − EPOCH)). Общий множитель exp(−λ·(now − EPOCH)) на
+# порядок не влияет, поэтому со временем оценки не устаревают и
+# пересчитывать нужно только рецепты с новыми или удалёнными событиями
+EPOCH = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+BATCH_SIZE = 1000
+
+
+def log_sum_exp(values):
+    if not values:
+        return 0.0
+    top = max(values)
+    return top + math.log(sum(math.exp(value - top) for value in values))
+
+
+def compute_scores(recipe_ids):
+    """Оценки рецептов по всем их добавлениям в избранное и корзины."""
+    rates = {
+        field: math.log(2) / half_life.total_seconds()
+        for field, half_life in HALF_LIVES.items()
+    }
+    exponents = {field: defaultdict(list) for field in HALF_LIVES}
+    for model, weight in WEIGHTS.items():
+        events = model.objects.filter(recipe_id__in=recipe_ids).values_list(
+            'recipe_id', 'created_at'
+        )
+        for recipe_id, created_at in events.iterator():
+            age = (created_at - EPOCH).total_seconds()
+            for field, rate in rates.items():
+                exponents[field][recipe_id].append(
+                    rate * age + math.log(weight)
+                )
+    return {
+        recipe_id: {
+            field: log_sum_exp(exponents[field][recipe_id])
+            for field in HALF_LIVES
+        }
+        for recipe_id in recipe_ids
+    }
+
+
+def refresh(full=False):
+    """Пересчитывает оценки рецептов, изменившихся с прошлого расчёта.
+
+    С full=True пересчитываются все рецепты: так оценки восстанавливаются
+    после массовой загрузки, которая не обновляет engagement_at.
+    Возвращает число пересчитанных рецептов.
+    """
+    started = timezone.now()
+    if full:
+        # Рецепты с событиями и рецепты, у которых оценки надо обнулить
+        recipe_ids = set(Recipe.objects.exclude(
+            popular_score=0, trending_score=0
+        ).values_list('id', flat=True))
+        for model in WEIGHTS:
+            recipe_ids.update(model.objects.order_by().values_list(
+                'recipe_id', flat=True
+            ).distinct())
+        recipe_ids = sorted(recipe_ids)
+    else:
+        recipe_ids = list(Recipe.objects.filter(
+            Q(scored_at=None) | Q(engagement_at__gte=F('scored_at')),
+            engagement_at__isnull=False
+        ).values_list('id', flat=True))
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        batch = recipe_ids[start:start + BATCH_SIZE]
+        scores = compute_scores(batch)
+        with transaction.atomic():
+            Recipe.objects.bulk_update(
+                [
+                    Recipe(pk=pk, scored_at=started, **values)
+                    for pk, values in scores.items()
+                ],
+                [*HALF_LIVES, 'scored_at'], batch_size=500
+            )
+    return len(recipe_ids)
@@ -0,0 +1,116 @@
+import re
+
+from django.db import connections, transaction
+from django.db.models import Case, F, Q, Value, When
+
+from api.indexes import normalize
+from api.models import Recipe, RecipeSearch
+
+TABLE = RecipeSearch._meta.db_table
+WORD = re.compile(r'\w+')
+# Окончания, которые отбрасываются, чтобы формы слова совпадали по префиксу:
+# «котлеты» ищется как «котлет*» и находит «котлета» и «котлетами»
+ENDINGS = sorted((
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ых', 'их',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю',
+    'ов', 'ев', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем',
+    'а', 'я', 'ы', 'и', 'у', 'ю', 'е', 'о', 'ь', 'й',
+), key=len, reverse=True)
+MIN_STEM = 3
+BATCH_SIZE = 2000
+
+_available = {}
+
+
+def stem(word):
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def search_words(query):
+    return [stem(word) for word in WORD.findall(normalize(query))]
+
+
+def match_expression(words):
+    """Запрос FTS5: все слова обязательны, каждое ищется как префикс."""
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def is_available(using):
+    """Есть ли в базе индекс FTS5; в остальных СУБД поиск идёт по LIKE."""
+    if using not in _available:
+        connection = connections[using]
+        _available[using] = (
+            connection.vendor == 'sqlite'
+            and TABLE in connection.introspection.table_names()
+        )
+    return _available[using]
+
+
+def index_recipe(recipe, using='default'):
+    if not is_available(using):
+        return
+    with transaction.atomic(using), connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [recipe.pk])
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, name, text) VALUES (%s, %s, %s)',
+            [recipe.pk, normalize(recipe.name), normalize(recipe.text)]
+        )
+
+
+def remove_recipe(recipe_id, using='default'):
+    if not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [recipe_id])
+
+
+def rebuild(using='default'):
+    """Заполняет индекс заново, например после bulk_create рецептов."""
+    if not is_available(using):
+        return
+    rows = Recipe.objects.using(using).values_list(
+        'id', 'name', 'text'
+    ).order_by().iterator(chunk_size=BATCH_SIZE)
+    with transaction.atomic(using), connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        batch = []
+        for pk, name, text in rows:
+            batch.append((pk, normalize(name), normalize(text)))
+            if len(batch) == BATCH_SIZE:
+                cursor.executemany(
+                    f'INSERT INTO {TABLE} (rowid, name, text) '
+                    'VALUES (%s, %s, %s)', batch
+                )
+                batch = []
+        if batch:
+            cursor.executemany(
+                f'INSERT INTO {TABLE} (rowid, name, text) VALUES (%s, %s, %s)',
+                batch
+            )
+
+
+def search_recipes(queryset, query):
+    """Рецепты, подходящие под запрос, от более релевантных к менее.
+
+    Совпадения в названии весят больше, чем в описании. Без FTS5 каждое
+    слово ищется через icontains, а выше идут совпадения в названии.
+    """
+    words = search_words(query)
+    if not words:
+        return queryset
+    if is_available(queryset.db):
+        return queryset.filter(
+            search_entry__document__match=match_expression(words)
+        ).annotate(
+            search_rank=F('search_entry__rank')
+        ).order_by('search_rank', '-pub_date', '-id')
+
+    condition = Q()
+    for word in words:
+        condition &= Q(name__icontains=word) | Q(text__icontains=word)
+    return queryset.filter(condition).annotate(search_rank=Case(
+        When(name__icontains=words[0], then=Value(0)), default=Value(1)
+    )).order_by('search_rank', '-pub_date', '-id')
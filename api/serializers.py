@@ -1,31 +1,32 @@
-import base64
-import uuid
-from django.core.files.base import ContentFile
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from api import fragments, shopping_list
+from api.indexes import recipe_ingredient_index, tag_catalog
+from core.fields import Base64ImageField, JSONListField
+from core.images import variant_urls
+from core.telemetry import TimedSerializerMixin
+from users.loaders import get_subscription_loader
+from users.models import User
 from users.serializers import CustomUserSerializer
 from api.models import (
-    Ingredient, Recipe, RecipeIngredient, Favorite, ShoppingCart
+    Ingredient, Recipe, RecipeIngredient, Favorite, ShoppingCart, Tag
 )
 
 
-class Base64ImageField(serializers.ImageField):
-    def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            id = uuid.uuid4()
-            data = ContentFile(base64.b64decode(imgstr), name=f'{id}.{ext}')
-        return super().to_internal_value(data)
-
-
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
 
 
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Tag
+        fields = ('id', 'name', 'slug')
+
+
 class RecipeIngredientSerializer(serializers.ModelSerializer):
     id = serializers.ReadOnlyField(source='ingredient.id')
     name = serializers.ReadOnlyField(source='ingredient.name')
@@ -38,7 +39,7 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Favorite
         fields = ('user', 'recipe')
@@ -61,7 +62,9 @@ class FavoriteSerializer(serializers.ModelSerializer):
         }
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class ShoppingCartSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
     class Meta:
         model = ShoppingCart
         fields = ('user', 'recipe')
@@ -84,29 +87,58 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
         }
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    """Заранее загружает подписки на авторов всех рецептов страницы.
+
+    Общие части карточек берутся из кэша фрагментов одним запросом к кэшу.
+    """
+
+    def to_representation(self, data):
+        request = self.context.get('request')
+        items = list(data.all() if hasattr(data, 'all') else data)
+        if request is not None:
+            get_subscription_loader(request).prime(
+                recipe.author_id for recipe in items
+            )
+        shared = fragments.render(
+            items, self.child.shared_representation, request
+        )
+        return [
+            self.child.with_live_fields(fragment, recipe)
+            for fragment, recipe in zip(shared, items)
+        ]
+
+
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     author = CustomUserSerializer(read_only=True)
-    ingredients_in_db = RecipeIngredientSerializer(
-        source='recipe_ingredients', many=True, read_only=True
-    )
+    ingredients_in_db = serializers.SerializerMethodField()
+    tags_in_db = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image_in_db = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     # Для записи
-    ingredients = serializers.ListField(
+    # В multipart-запросе ингредиенты передаются строкой JSON
+    ingredients = JSONListField(
         child=serializers.DictField(),
         write_only=True
     )
     image = Base64ImageField(write_only=True)
+    tags = serializers.PrimaryKeyRelatedField(
+        queryset=Tag.objects.all(), many=True, write_only=True,
+        required=False
+    )
 
     class Meta:
         model = Recipe
         fields = (
-            'id', 'author', 'ingredients', 'is_favorited',
+            'id', 'tags', 'author', 'ingredients', 'is_favorited',
             'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time',
-            'ingredients_in_db', 'image_in_db',
+            'ingredients_in_db', 'tags_in_db', 'image_in_db',
+            'image_variants', 'favorites_count', 'in_carts_count',
         )
+        list_serializer_class = RecipeListSerializer
 
     def get_image_in_db(self, obj):
         request = self.context.get('request')
@@ -114,25 +146,48 @@ class RecipeSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.image.url)
         return None
 
+    def get_tags_in_db(self, obj):
+        # Теги берутся по маске из каталога в памяти; снимок каталога один
+        # на весь ответ, в том числе на страницу списка
+        tags = self.context.get('tag_catalog')
+        if tags is None:
+            tags = tag_catalog.snapshot()
+            self.context['tag_catalog'] = tags
+        return [data for mask, data in tags if obj.tag_mask & mask]
+
+    def get_image_variants(self, obj):
+        return variant_urls(
+            self.context.get('request'), obj.image, obj.image_variants
+        )
+
     def get_is_favorited(self, obj):
+        # Значение берём из аннотации RecipeViewSet.get_queryset, если она есть
+        if hasattr(obj, 'is_favorited'):
+            return bool(obj.is_favorited)
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            from api.models import Favorite
             return Favorite.objects.filter(user=request.user, recipe=obj).exists()
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return bool(obj.is_in_shopping_cart)
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            from api.models import ShoppingCart
             return ShoppingCart.objects.filter(user=request.user, recipe=obj).exists()
         return False
 
     def validate_ingredients(self, value):
+        """Проверяет состав и возвращает список {'ingredient', 'amount'}.
+
+        Все id проверяются одним запросом, загруженные ингредиенты потом
+        используются при записи и в ответе. Ингредиенты, уже загруженные
+        вместе с изменяемым рецептом, повторно не запрашиваются.
+        """
         if not value or len(value) == 0:
             raise ValidationError('Добавьте хотя бы один ингредиент')
 
-        seen_ids = set()
+        amounts = {}
         for item in value:
             if 'id' not in item:
                 raise ValidationError('У ингредиента должно быть поле "id"')
@@ -145,46 +200,82 @@ class RecipeSerializer(serializers.ModelSerializer):
             except (TypeError, ValueError):
                 raise ValidationError('ID и количество должны быть целыми числами')
 
-            if ingredient_id in seen_ids:
+            if ingredient_id in amounts:
                 raise ValidationError(f'Ингредиент с ID {ingredient_id} повторяется')
-            seen_ids.add(ingredient_id)
-
-            if not Ingredient.objects.filter(id=ingredient_id).exists():
-                raise ValidationError(f'Ингредиент с ID {ingredient_id} не существует')
-
             if amount <= 0:
                 raise ValidationError('Количество должно быть больше нуля')
+            amounts[ingredient_id] = amount
 
-        return value
+        ingredients = {
+            row.ingredient_id: row.ingredient
+            for row in self.loaded_ingredients()
+        }
+        missing = [pk for pk in amounts if pk not in ingredients]
+        if missing:
+            ingredients.update(Ingredient.objects.in_bulk(missing))
+        for ingredient_id in amounts:
+            if ingredient_id not in ingredients:
+                raise ValidationError(f'Ингредиент с ID {ingredient_id} не существует')
+        return [
+            {'ingredient': ingredients[ingredient_id], 'amount': amount}
+            for ingredient_id, amount in amounts.items()
+        ]
 
+    def loaded_ingredients(self):
+        """Строки состава изменяемого рецепта из кэша prefetch, если есть."""
+        cache = getattr(self.instance, '_prefetched_objects_cache', {})
+        if 'recipe_ingredients' not in cache:
+            return []
+        return self.instance.recipe_ingredients.all()
+
+    def get_ingredients_in_db(self, obj):
+        # После записи состав берётся из written_ingredients без запроса
+        rows = getattr(obj, 'written_ingredients', None)
+        if rows is None:
+            rows = obj.recipe_ingredients.all()
+        return RecipeIngredientSerializer(
+            rows, many=True, context=self.context
+        ).data
+
+    @staticmethod
+    def remember_ingredients(recipe, rows):
+        # Порядок как у чтения из базы: по первичному ключу
+        recipe.written_ingredients = sorted(rows, key=lambda row: row.pk)
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
-        image_data = validated_data.pop('image')
+        tags = validated_data.pop('tags', None)
         validated_data.pop('author', None)
         recipe = Recipe.objects.create(
-            author=self.context['request'].user,
-            image=image_data,
-            **validated_data
+            author=self.context['request'].user, **validated_data
         )
+        # Сигнал увеличил recipes_count в базе через F(), а не в объекте
+        recipe.author.refresh_from_db(fields=User.COUNTERS)
 
-        recipe_ingredients = [
-            RecipeIngredient(
-                recipe=recipe,
-                ingredient_id=item['id'],
-                amount=item['amount']
-            ) for item in ingredients_data
-        ]
-        RecipeIngredient.objects.bulk_create(recipe_ingredients)
-        recipe.save()
+        rows = RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, **item)
+            for item in ingredients_data
+        )
+        recipe_ingredient_index.update_on_commit(
+            recipe.id, [item['ingredient'].pk for item in ingredients_data]
+        )
+        if tags:
+            recipe.tags.set(tags)
+        # Новый рецепт ещё никто не добавил в избранное или корзину
+        recipe.is_favorited = recipe.is_in_shopping_cart = False
+        self.remember_ingredients(recipe, rows)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients_data = validated_data.get('ingredients')  # Не используем pop(), чтобы не терять информацию
+        ingredients_data = validated_data.pop('ingredients', None)
 
         if ingredients_data is None:
             raise ValidationError({'ingredients': ['Это поле обязательно']})
 
         image_data = validated_data.pop('image', None)
+        tags = validated_data.pop('tags', None)
 
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
@@ -193,29 +284,107 @@ class RecipeSerializer(serializers.ModelSerializer):
         if image_data:
             instance.image = image_data
 
-        if ingredients_data is not None:
-            instance.recipe_ingredients.all().delete()
-            recipe_ingredients = [
-                RecipeIngredient(
-                    recipe=instance,
-                    ingredient_id=item['id'],
-                    amount=item['amount']
-                ) for item in ingredients_data
-            ]
-            RecipeIngredient.objects.bulk_create(recipe_ingredients)
+        rows = self.update_ingredients(instance, ingredients_data)
+
+        if tags is not None:
+            instance.tags.set(tags)
 
         instance.save()
+        self.remember_ingredients(instance, rows)
         return instance
 
+    def update_ingredients(self, instance, ingredients_data):
+        """Меняет только добавленные, удалённые и изменённые строки состава.
+
+        Возвращает итоговые строки с уже загруженными ингредиентами.
+        """
+        # Состав обычно уже загружен вместе с рецептом в get_object
+        current = {
+            row.ingredient_id: row
+            for row in instance.recipe_ingredients.all()
+        }
+        wanted = {item['ingredient'].pk: item for item in ingredients_data}
+        removed = [
+            row.pk for ingredient_id, row in current.items()
+            if ingredient_id not in wanted
+        ]
+        changed, added, kept = [], [], []
+        for ingredient_id, item in wanted.items():
+            row = current.get(ingredient_id)
+            if row is None:
+                added.append(RecipeIngredient(recipe=instance, **item))
+                continue
+            row.ingredient = item['ingredient']
+            if row.amount != item['amount']:
+                row.amount = item['amount']
+                changed.append(row)
+            kept.append(row)
+
+        if removed:
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        if added:
+            added = RecipeIngredient.objects.bulk_create(added)
+        changed_ids = {
+            *(ingredient_id for ingredient_id in current
+              if ingredient_id not in wanted),
+            *(row.ingredient_id for row in (*changed, *added)),
+        }
+        if changed_ids:
+            shopping_list.refresh_recipe(instance.id, changed_ids)
+        if removed or added:
+            recipe_ingredient_index.update_on_commit(
+                instance.id, list(wanted)
+            )
+        return [*kept, *added]
+
     def to_representation(self, instance):
-        # Сначала проверяем флаг
+        [data] = fragments.render(
+            [instance], self.shared_representation,
+            self.context.get('request')
+        )
+        return self.with_live_fields(data, instance)
+
+    def with_live_fields(self, data, instance):
+        """Дополняет общий фрагмент признаками пользователя и счётчиками.
 
+        Счётчики меняются чаще карточки, поэтому берутся из строки рецепта
+        и автора, а не из кэша.
+        """
+        request = self.context.get('request')
+        author = instance.author
+        return {
+            **data,
+            'author': {
+                **data['author'],
+                'is_subscribed': request is not None and (
+                    get_subscription_loader(request).is_subscribed(author.pk)
+                ),
+                'recipes_count': author.recipes_count,
+                'subscribers_count': author.subscribers_count,
+            },
+            'is_favorited': self.get_is_favorited(instance),
+            'is_in_shopping_cart': self.get_is_in_shopping_cart(instance),
+            'favorites_count': instance.favorites_count,
+            'in_carts_count': instance.in_carts_count,
+        }
+
+    def shared_representation(self, instance):
+        """Карточка рецепта без признаков пользователя и счётчиков."""
         data = super().to_representation(instance)
+        for field in ('is_favorited', 'is_in_shopping_cart', *Recipe.COUNTERS):
+            data[field] = None
+        for field in ('is_subscribed', *User.COUNTERS):
+            data['author'][field] = None
 
         if 'ingredients_in_db' in data:
             data['ingredients'] = data['ingredients_in_db']
             data.pop('ingredients_in_db', None)
 
+        if 'tags_in_db' in data:
+            data['tags'] = data.pop('tags_in_db')
+
         if 'image_in_db' in data:
             data['image'] = data['image_in_db']
             data.pop('image_in_db', None)
@@ -223,14 +392,24 @@ class RecipeSerializer(serializers.ModelSerializer):
         return data
 
 
-class RecipeShortLinkSerializer(serializers.Serializer):
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для массовых операций с избранным и корзиной."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False, max_length=100
+    )
+
+
+class RecipeShortLinkSerializer(TimedSerializerMixin, serializers.Serializer):
     short_link = serializers.URLField(read_only=True)
 
     def to_representation(self, instance):
-        return {'short-link': instance.short_link}
+        return {'short-link': instance.get_short_link()}
 
 
-class ShoppingCartRecipeSerializer(serializers.Serializer):
+class ShoppingCartRecipeSerializer(
+    TimedSerializerMixin, serializers.Serializer
+):
     id = serializers.IntegerField(source='recipe.id')
     name = serializers.CharField(source='recipe.name')
     image = serializers.SerializerMethodField()
@@ -253,7 +432,9 @@ class ShoppingCartRecipeSerializer(serializers.Serializer):
         }
 
 
-class FavoriteRecipeSerializer(serializers.ModelSerializer):
+class FavoriteRecipeSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
     image = serializers.SerializerMethodField()
 
     class Meta:
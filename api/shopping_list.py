@@ -0,0 +1,75 @@
+from django.db import transaction
+from django.db.models import Sum
+
+from api.models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+
+def refresh_items(user_ids, ingredient_ids=None):
+    """Пересчитывает позиции списка покупок пользователей.
+
+    Если ingredient_ids не передан, список пользователей строится заново
+    целиком, иначе пересчитываются только указанные ингредиенты.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    sources = RecipeIngredient.objects.filter(
+        recipe__in_shopping_cart__user__in=user_ids
+    )
+    items = ShoppingListItem.objects.filter(user_id__in=user_ids)
+    if ingredient_ids is not None:
+        ingredient_ids = list(ingredient_ids)
+        if not ingredient_ids:
+            return
+        sources = sources.filter(ingredient_id__in=ingredient_ids)
+        items = items.filter(ingredient_id__in=ingredient_ids)
+    totals = sources.values_list(
+        'recipe__in_shopping_cart__user', 'ingredient'
+    ).annotate(total=Sum('amount')).order_by()
+    with transaction.atomic():
+        items.delete()
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                             amount=total)
+            for user_id, ingredient_id, total in totals
+        )
+
+
+def recipe_ingredient_ids(recipe_id):
+    return RecipeIngredient.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('ingredient_id', flat=True)
+
+
+def refresh_cart_recipe(user_id, recipe_id):
+    """Обновляет список покупок после добавления или удаления рецепта."""
+    ingredient_ids = list(recipe_ingredient_ids(recipe_id))
+    if ingredient_ids:
+        refresh_items([user_id], ingredient_ids)
+    else:
+        # Ингредиенты рецепта уже удалены каскадом, пересчитываем всё
+        refresh_items([user_id])
+
+
+def refresh_recipe(recipe_id, ingredient_ids):
+    """Обновляет списки покупок всех, у кого рецепт лежит в корзине."""
+    refresh_items(
+        ShoppingCart.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('user_id', flat=True),
+        ingredient_ids
+    )
+
+
+def rebuild(user_ids=None):
+    """Строит списки покупок заново по содержимому корзин."""
+    if user_ids is None:
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            refresh_items(
+                ShoppingCart.objects.values_list(
+                    'user_id', flat=True
+                ).distinct()
+            )
+        return
+    refresh_items(user_ids)
@@ -0,0 +1,274 @@
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api import feed, fragments, search
+from api.indexes import (
+    ingredient_catalog, ingredient_index, recipe_ingredient_index,
+    tag_catalog
+)
+from api.models import (
+    ENGAGEMENT_COUNTERS, FeedEntry, Favorite, Ingredient, Recipe,
+    RecipeIngredient, ShoppingCart, Tag, short_code_key
+)
+from api.shopping_list import (
+    recipe_ingredient_ids, refresh_cart_recipe, refresh_items
+)
+from core.conditional import touch
+from core.counters import shift
+from core.images import schedule_variants
+from core.pagination import invalidate_counts
+from users.models import Subscription, User
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def reset_paginated_counts(sender, **kwargs):
+    invalidate_counts()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def touch_recipes(sender, update_fields=None, **kwargs):
+    # Карточки рецептов включают автора, теги и ингредиенты, поэтому их
+    # изменения тоже меняют Last-Modified списков
+    if update_fields and set(update_fields) <= {'last_login', 'password'}:
+        return
+    touch(Recipe)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def touch_ingredient_recipes(sender, instance, created=False, **kwargs):
+    if not created:
+        Recipe.objects.filter(
+            recipe_ingredients__ingredient=instance
+        ).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def reset_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+    ingredient_catalog.invalidate()
+
+
+@receiver(post_delete, sender=Ingredient)
+def reset_recipe_ingredient_index(sender, **kwargs):
+    # Ингредиент удаляется из всех рецептов сразу, поэтому индекс
+    # перестраивается целиком
+    recipe_ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def drop_recipe_fragment(sender, instance, **kwargs):
+    fragments.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def drop_fragment_of_ingredient_recipe(sender, instance, origin=None,
+                                       **kwargs):
+    # При удалении рецепта фрагмент сбрасывает обработчик рецепта
+    if not isinstance(origin, Recipe):
+        fragments.invalidate([instance.recipe_id])
+
+
+@receiver(post_save, sender=User)
+def drop_author_fragments(sender, instance, created, update_fields=None,
+                          **kwargs):
+    if created or (
+        update_fields and set(update_fields) <= {'last_login', 'password'}
+    ):
+        return
+    fragments.invalidate(
+        instance.recipes.values_list('id', flat=True).iterator()
+    )
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    if created:
+        refresh_cart_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, origin=None, **kwargs):
+    # При удалении рецепта списки пересчитывает обработчик рецепта
+    if isinstance(origin, Recipe):
+        return
+    refresh_cart_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remember_carted_recipe(sender, instance, **kwargs):
+    instance._cart_user_ids = list(
+        instance.in_shopping_cart.values_list('user_id', flat=True)
+    )
+    instance._cart_ingredient_ids = list(recipe_ingredient_ids(instance.pk))
+
+
+@receiver(post_delete, sender=Recipe)
+def refresh_lists_after_recipe_delete(sender, instance, **kwargs):
+    refresh_items(
+        getattr(instance, '_cart_user_ids', ()),
+        getattr(instance, '_cart_ingredient_ids', None)
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def forget_short_code(sender, instance, **kwargs):
+    cache.delete_many([
+        short_code_key(code) for code in instance.short_codes()
+    ])
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_ingredient_index(sender, instance, **kwargs):
+    recipe_ingredient_index.remove_recipe(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def make_image_variants(sender, instance, **kwargs):
+    schedule_variants(instance, 'image', 'image_variants')
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe(sender, instance, using, update_fields=None, **kwargs):
+    if update_fields and not {'name', 'text'} & set(update_fields):
+        return
+    search.index_recipe(instance, using)
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(sender, instance, using, **kwargs):
+    search.remove_recipe(instance.pk, using)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def reset_tag_catalog(sender, **kwargs):
+    tag_catalog.invalidate()
+
+
+@receiver(post_save, sender=Tag)
+def touch_tag_recipes(sender, instance, created, **kwargs):
+    if not created:
+        Recipe.objects.filter(tags=instance).update(
+            updated_at=timezone.now()
+        )
+
+
+@receiver(pre_delete, sender=Tag)
+def clear_tag_bit(sender, instance, **kwargs):
+    # Строки связи удаляются каскадом без m2m_changed
+    Recipe.objects.filter(tags=instance).update(
+        tag_mask=F('tag_mask').bitand(~instance.mask),
+        updated_at=timezone.now()
+    )
+    invalidate_counts()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def update_tag_mask(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        instance._cleared_recipe_ids = list(
+            instance.recipes.values_list('id', flat=True)
+        )
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif action == 'post_clear':
+        recipe_ids = getattr(instance, '_cleared_recipe_ids', [])
+    else:
+        recipe_ids = pk_set
+    now = timezone.now()
+    for recipe_id in recipe_ids:
+        mask = 0
+        for bit in Tag.objects.filter(recipes=recipe_id).values_list(
+            'bit', flat=True
+        ):
+            mask |= 1 << bit
+        Recipe.objects.filter(pk=recipe_id).update(
+            tag_mask=mask, updated_at=now
+        )
+        if not reverse:
+            instance.tag_mask, instance.updated_at = mask, now
+    invalidate_counts()
+    touch(Recipe)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def count_engagement(sender, instance, created, **kwargs):
+    if created:
+        shift(Recipe, instance.recipe_id, ENGAGEMENT_COUNTERS[sender], 1,
+              engagement_at=timezone.now())
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def uncount_engagement(sender, instance, origin=None, **kwargs):
+    # Счётчики удаляемого рецепта обновлять незачем
+    if isinstance(origin, Recipe) and origin.pk == instance.recipe_id:
+        return
+    shift(Recipe, instance.recipe_id, ENGAGEMENT_COUNTERS[sender], -1,
+          engagement_at=timezone.now())
+
+
+@receiver(post_save, sender=Recipe)
+def count_author_recipe(sender, instance, created, **kwargs):
+    if created:
+        shift(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def uncount_author_recipe(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, User) and origin.pk == instance.author_id:
+        return
+    shift(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def publish_to_feed(sender, instance, created, **kwargs):
+    if created:
+        feed.publish(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def refill_feed(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, User) and origin.pk == instance.author_id:
+        return
+    feed.refill_author(instance.author_id)
+
+
+@receiver(post_save, sender=Subscription)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created:
+        feed.backfill([instance.user_id], instance.author_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def clean_feed(sender, instance, origin=None, **kwargs):
+    # При удалении пользователя его входящие удалятся каскадом
+    if isinstance(origin, User):
+        return
+    FeedEntry.objects.filter(
+        user_id=instance.user_id, author_id=instance.author_id
+    ).delete()
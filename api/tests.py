@@ -1,3 +1,1864 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from api.admin import RecipeAdmin
+from api.indexes import (
+    RecipeIngredientIndex, ingredient_catalog, ingredient_index,
+    recipe_ingredient_index, tag_catalog
+)
+from api.models import (
+    FeedEntry, Favorite, Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+    ShoppingListItem, Tag, short_code_key
+)
+from core.conditional import changed_key
+from core.middleware import PIN_COOKIE, ReplicaRoutingMiddleware
+from core.pagination import CustomPagination
+from core.routers import PrimaryReplicaRouter, use_replicas
+from core.telemetry import QueryBudgetExceeded, registry
+from users.models import Subscription, User
+
+
+class RecipeListQueriesTest(TestCase):
+    """Количество запросов на страницу рецептов не зависит от её размера."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user(
+            email='viewer@example.com', username='viewer',
+            first_name='Viewer', last_name='Viewer', password='password'
+        )
+        cls.token = Token.objects.create(user=cls.viewer)
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {i}', measurement_unit='г')
+            for i in range(3)
+        )
+        for i in range(20):
+            author = User.objects.create(
+                email=f'author{i}@example.com', username=f'author{i}',
+                first_name='Author', last_name=str(i)
+            )
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {i}', text='Описание',
+                cooking_time=10, image='recipes/test.png'
+            )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=100)
+                for ingredient in ingredients
+            )
+            if i % 2:
+                Favorite.objects.create(user=cls.viewer, recipe=recipe)
+                ShoppingCart.objects.create(user=cls.viewer, recipe=recipe)
+                Subscription.objects.create(user=cls.viewer, author=author)
+
+    def count_queries(self, client, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()
+
+    def assert_constant_queries(self, client, url_template):
+        small, _ = self.count_queries(client, url_template.format(limit=2))
+        large, data = self.count_queries(client, url_template.format(limit=20))
+        self.assertEqual(len(data.get('results', data)), 20)
+        self.assertEqual(small, large)
+        return data
+
+    def test_recipe_list_anonymous(self):
+        data = self.assert_constant_queries(
+            APIClient(), '/api/recipes/?limit={limit}'
+        )
+        for recipe in data['results']:
+            self.assertFalse(recipe['is_favorited'])
+            self.assertFalse(recipe['author']['is_subscribed'])
+            self.assertEqual(len(recipe['ingredients']), 3)
+
+    def test_recipe_list_authenticated(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        data = self.assert_constant_queries(
+            client, '/api/recipes/?limit={limit}'
+        )
+        for recipe in data['results']:
+            flagged = Favorite.objects.filter(
+                user=self.viewer, recipe_id=recipe['id']
+            ).exists()
+            self.assertEqual(recipe['is_favorited'], flagged)
+            self.assertEqual(recipe['is_in_shopping_cart'], flagged)
+            self.assertEqual(recipe['author']['is_subscribed'], flagged)
+
+    def test_recipe_detail(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        recipe = Favorite.objects.filter(user=self.viewer).first().recipe
+        queries, data = self.count_queries(
+            client, f'/api/recipes/{recipe.id}/'
+        )
+        self.assertTrue(data['is_favorited'])
+        self.assertTrue(data['author']['is_subscribed'])
+        self.assertLessEqual(queries, 5)
+
+
+class RecipeCursorPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author'
+        )
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'Рецепт {i}', text='Описание',
+                   cooking_time=10, image='recipes/test.png')
+            for i in range(15)
+        )
+        # Одинаковая дата у части рецептов проверяет добор ключа по id
+        Recipe.objects.filter(
+            id__in=Recipe.objects.values('id')[:8]
+        ).update(pub_date=timezone.now())
+
+    def test_cursor_walk_matches_offset_order(self):
+        client = APIClient()
+        expected = [
+            recipe['id'] for recipe in
+            client.get('/api/recipes/?limit=100').json()['results']
+        ]
+        seen, pages = [], []
+        url = '/api/recipes/?limit=4&cursor='
+        while url:
+            data = client.get(url).json()
+            self.assertIn('count', data)
+            pages.append(data)
+            seen.extend(recipe['id'] for recipe in data['results'])
+            url = data['next']
+        self.assertEqual(seen, expected)
+        self.assertIsNone(pages[0]['previous'])
+
+        previous = client.get(pages[2]['previous']).json()
+        self.assertEqual(previous['results'], pages[1]['results'])
+
+    def test_invalid_cursor(self):
+        response = APIClient().get('/api/recipes/?cursor=broken')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_with_wrong_value_types(self):
+        for values in (['x', 'y'], [None, 1], [[1], {'a': 1}]):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps({'v': values}).encode()
+            ).decode().rstrip('=')
+            response = APIClient().get(f'/api/recipes/?cursor={cursor}')
+            self.assertEqual(response.status_code, 404, values)
+
+
+class PaginationCountTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create(
+            email='viewer@example.com', username='viewer',
+            first_name='Viewer', last_name='Viewer'
+        )
+        cls.token = Token.objects.create(user=cls.viewer)
+        cls.recipes = Recipe.objects.bulk_create(
+            Recipe(author=cls.viewer, name=f'Рецепт {i}', text='Описание',
+                   cooking_time=10, image='recipes/test.png')
+            for i in range(5)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def count_statements(self, url):
+        with CaptureQueriesContext(connection) as context:
+            data = self.client.get(url).json()
+        counts = [
+            query for query in context.captured_queries
+            if 'COUNT(' in query['sql']
+        ]
+        return len(counts), data
+
+    def test_count_is_cached_and_invalidated(self):
+        url = '/api/recipes/?is_favorited=1'
+        statements, data = self.count_statements(url)
+        self.assertEqual((statements, data['count']), (1, 0))
+        self.assertTrue(data['count_exact'])
+
+        statements, data = self.count_statements(url)
+        self.assertEqual((statements, data['count']), (0, 0))
+
+        Favorite.objects.create(user=self.viewer, recipe=self.recipes[0])
+        statements, data = self.count_statements(url)
+        self.assertEqual((statements, data['count']), (1, 1))
+
+    @override_settings(PAGINATION_ESTIMATE_THRESHOLD=1)
+    def test_anonymous_unfiltered_count_is_estimated(self):
+        data = APIClient().get('/api/recipes/').json()
+        self.assertFalse(data['count_exact'])
+        self.assertGreaterEqual(data['count'], len(self.recipes))
+
+        data = APIClient().get(f'/api/recipes/?author={self.viewer.id}')
+        self.assertTrue(data.json()['count_exact'])
+
+
+class IngredientSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create([
+            Ingredient(name='яблочный сок', measurement_unit='мл'),
+            Ingredient(name='Яблоки', measurement_unit='г'),
+            Ingredient(name='ёжевика', measurement_unit='г'),
+            Ingredient(name='груша', measurement_unit='г'),
+        ])
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.invalidate()
+
+    def search(self, name):
+        return [
+            item['name'] for item in
+            APIClient().get('/api/ingredients/', {'name': name}).json()
+        ]
+
+    def test_prefix_search_is_case_insensitive(self):
+        self.assertEqual(self.search('ЯБЛ'), ['Яблоки', 'яблочный сок'])
+        self.assertEqual(self.search('ежев'), ['ёжевика'])
+        self.assertEqual(self.search('слива'), [])
+
+    def test_search_does_not_query_database_when_warm(self):
+        self.search('гру')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search('гру'), ['груша'])
+
+    def test_index_is_rebuilt_on_change(self):
+        self.assertEqual(self.search('гру'), ['груша'])
+        Ingredient.objects.create(name='грузди', measurement_unit='г')
+        self.assertEqual(self.search('гру'), ['груша', 'грузди'])
+
+
+class IngredientCatalogTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {i}', measurement_unit='г')
+            for i in range(10)
+        )
+
+    def setUp(self):
+        cache.clear()
+        ingredient_catalog.invalidate()
+
+    def test_catalog_is_served_with_etag(self):
+        response = self.client.get('/api/ingredients/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 10)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/api/ingredients/', HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+
+    def test_catalog_is_compressed(self):
+        response = self.client.get(
+            '/api/ingredients/', HTTP_ACCEPT_ENCODING='gzip, deflate'
+        )
+        self.assertIn(response['Content-Encoding'], ('gzip', 'br'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_catalog_changes_with_ingredients(self):
+        etag = self.client.get('/api/ingredients/')['ETag']
+        Ingredient.objects.create(name='Новый', measurement_unit='г')
+        response = self.client.get(
+            '/api/ingredients/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 11)
+
+
+class LoadIngredientsTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def load(self, path, *args):
+        output = StringIO()
+        call_command('load_ingredients', path, *args, stdout=output)
+        return output.getvalue()
+
+    def test_json_is_loaded_in_batches_without_duplicates(self):
+        path = self.write('ingredients.json', json.dumps([
+            {'name': f'Ингредиент {i}', 'measurement_unit': 'г'}
+            for i in range(25)
+        ] + [{'name': 'Ингредиент 0', 'measurement_unit': 'г'}]))
+        output = self.load(path, '--batch-size', '10')
+        self.assertIn('Прочитано 26, добавлено 25', output)
+        self.assertEqual(Ingredient.objects.count(), 25)
+
+        output = self.load(path)
+        self.assertIn('добавлено 0', output)
+        self.assertEqual(Ingredient.objects.count(), 25)
+
+    def test_csv_is_loaded(self):
+        path = self.write('ingredients.csv', 'соль,г\n"мука, пшеничная",г\n')
+        self.load(path)
+        self.assertEqual(
+            sorted(Ingredient.objects.values_list('name', flat=True)),
+            ['мука, пшеничная', 'соль']
+        )
+
+    def test_short_csv_row_reports_line(self):
+        path = self.write('ingredients.csv', 'соль,г\nмука\n')
+        with self.assertRaisesMessage(CommandError, 'Строка 2'):
+            self.load(path)
+        self.assertFalse(Ingredient.objects.exists())
+
+    def test_json_item_without_fields_reports_number(self):
+        path = self.write(
+            'ingredients.json',
+            '[{"name": "соль", "measurement_unit": "г"}, {"name": "мука"}]'
+        )
+        with self.assertRaisesMessage(CommandError, 'Элемент 2'):
+            self.load(path)
+        self.assertFalse(Ingredient.objects.exists())
+
+    def test_search_index_is_reset(self):
+        ingredient_index.invalidate()
+        self.assertEqual(ingredient_index.search('сол', 10), [])
+        self.load(self.write('ingredients.csv', 'соль,г\n'))
+        self.assertEqual(
+            [item['name'] for item in ingredient_index.search('сол', 10)],
+            ['соль']
+        )
+
+
+class LoadBenchmarkTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {i}', measurement_unit='г')
+            for i in range(20)
+        )
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        override = override_settings(MEDIA_ROOT=media, IMAGE_VARIANT_WORKERS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_dataset_and_load_run(self):
+        call_command(
+            'generate_dataset', '--users', '10', '--recipes', '30',
+            '--favorites', '50', '--carts', '20', '--subscriptions', '20',
+            stdout=StringIO()
+        )
+        self.assertEqual(Recipe.objects.count(), 30)
+        self.assertTrue(Favorite.objects.exists())
+        self.assertTrue(ShoppingListItem.objects.exists())
+        self.assertEqual(
+            RecipeIngredient.objects.values('recipe').distinct().count(), 30
+        )
+
+        report = os.path.join(settings.MEDIA_ROOT, 'report.json')
+        call_command(
+            'run_load', '--requests', '40', '--warmup', '0', '--json', report,
+            stdout=StringIO()
+        )
+        with open(report, encoding='utf-8') as file:
+            data = json.load(file)
+        self.assertEqual(data['requests'], 40)
+        for endpoint in data['endpoints']:
+            self.assertEqual(endpoint['errors'], 0, endpoint['name'])
+            self.assertLessEqual(endpoint['p50_ms'], endpoint['p99_ms'])
+
+
+class RecipeSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author'
+        )
+        for name, text in (
+            ('Котлеты домашние', 'Жарим на сковороде.'),
+            ('Суп с фрикадельками', 'Подаём с котлетой и зеленью.'),
+            ('Салат из ёлочных грибов', 'Свежий и лёгкий.'),
+            ('Пирог', 'С яблоками.'),
+        ):
+            Recipe.objects.create(
+                author=cls.author, name=name, text=text, cooking_time=10,
+                image='recipes/test.png'
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query, **params):
+        response = APIClient().get(
+            '/api/recipes/', {'search': query, **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def names(self, query):
+        return [recipe['name'] for recipe in self.search(query)['results']]
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(
+            self.names('котлеты'), ['Котлеты домашние', 'Суп с фрикадельками']
+        )
+
+    def test_prefix_and_yo_matching(self):
+        self.assertEqual(self.names('ЕЛОЧН'), ['Салат из ёлочных грибов'])
+        self.assertEqual(self.names('яблоко'), ['Пирог'])
+        self.assertEqual(self.names('котлеты сковорода'), ['Котлеты домашние'])
+        self.assertEqual(self.names('борщ'), [])
+
+    def test_results_are_paginated(self):
+        data = self.search('котлет', limit=1)
+        self.assertEqual((data['count'], len(data['results'])), (2, 1))
+
+    def test_index_follows_changes(self):
+        recipe = Recipe.objects.get(name='Пирог')
+        recipe.name = 'Шарлотка'
+        recipe.save()
+        self.assertEqual(self.names('шарлотк'), ['Шарлотка'])
+        self.assertEqual(self.names('пирог'), [])
+        recipe.delete()
+        self.assertEqual(self.names('шарлотк'), [])
+
+    def test_fallback_without_fts(self):
+        # LIKE в SQLite не учитывает регистр только для латиницы
+        with mock.patch('api.search.is_available', return_value=False):
+            self.assertEqual(self.names('грибы'), ['Салат из ёлочных грибов'])
+            self.assertEqual(self.names('яблоки свежие'), [])
+
+
+class RecipeIngredientSetFilterTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author'
+        )
+        cls.token = Token.objects.create(user=cls.author)
+        cls.a, cls.b, cls.c, cls.d = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('a', 'b', 'c', 'd')
+        )
+        cls.recipes = {}
+        for name, ingredients in (
+            ('ab', (cls.a, cls.b)), ('ac', (cls.a, cls.c)),
+            ('d', (cls.d,)), ('abc', (cls.a, cls.b, cls.c)), ('empty', ()),
+        ):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=name, text='Описание',
+                cooking_time=10, image='recipes/test.png'
+            )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=1)
+                for ingredient in ingredients
+            )
+            cls.recipes[name] = recipe
+
+    def setUp(self):
+        cache.clear()
+        recipe_ingredient_index.invalidate()
+
+    def names(self, **params):
+        params = {
+            key: ','.join(str(item.id) for item in value)
+            for key, value in params.items()
+        }
+        response = APIClient().get('/api/recipes/', params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(recipe['name'] for recipe in response.json()['results'])
+
+    def test_set_filters(self):
+        self.assertEqual(self.names(has_all=(self.a, self.b)), ['ab', 'abc'])
+        self.assertEqual(
+            self.names(has_any=(self.c, self.d)), ['abc', 'ac', 'd']
+        )
+        self.assertEqual(self.names(exclude=(self.c,)), ['ab', 'd', 'empty'])
+        self.assertEqual(
+            self.names(pantry=(self.a, self.b, self.c)), ['ab', 'abc', 'ac']
+        )
+        self.assertEqual(
+            self.names(has_any=(self.a,), exclude=(self.c,)), ['ab']
+        )
+
+    def test_invalid_ids_are_rejected(self):
+        response = APIClient().get('/api/recipes/', {'has_all': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_index_follows_recipe_changes(self):
+        self.assertEqual(self.names(has_all=(self.d,)), ['d'])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        # Файла изображения нет, варианты для него не строим
+        with mock.patch('api.signals.schedule_variants'), \
+                self.captureOnCommitCallbacks() as callbacks:
+            response = client.patch(
+                f'/api/recipes/{self.recipes["ab"].id}/',
+                {'ingredients': [{'id': self.d.id, 'amount': 5}]},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['ingredients'][0]['id'], self.d.id)
+        # До фиксации транзакции индекс не меняется
+        self.assertEqual(self.names(has_all=(self.d,)), ['d'])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.names(has_all=(self.d,)), ['ab', 'd'])
+        self.assertEqual(self.names(has_all=(self.a, self.b)), ['abc'])
+
+        self.recipes['abc'].delete()
+        self.assertEqual(self.names(has_any=(self.b,)), [])
+
+    def test_admin_edit_reindexes_on_commit(self):
+        self.assertEqual(self.names(has_all=(self.a,)), ['ab', 'abc', 'ac'])
+        # Строку состава уже сохранил inline-формсет админки
+        RecipeIngredient.objects.create(
+            recipe=self.recipes['d'], ingredient=self.a, amount=1
+        )
+        request = RequestFactory().post('/admin/')
+        with self.captureOnCommitCallbacks() as callbacks:
+            RecipeAdmin(Recipe, admin.site).save_related(
+                request, mock.Mock(instance=self.recipes['d']), [], True
+            )
+        self.assertEqual(self.names(has_all=(self.a,)), ['ab', 'abc', 'ac'])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(
+            self.names(has_all=(self.a,)), ['ab', 'abc', 'ac', 'd']
+        )
+
+    def test_other_processes_catch_up_from_journal(self):
+        other = RecipeIngredientIndex()
+        other.match(has_all=(self.a.id,))
+        RecipeIngredient.objects.create(
+            recipe=self.recipes['d'], ingredient=self.a, amount=1
+        )
+        recipe_ingredient_index.update_recipe(self.recipes['d'].id)
+        with mock.patch.object(other, 'build') as build:
+            with self.assertNumQueries(2):
+                self.assertIn(
+                    self.recipes['d'].id, other.match(has_all=(self.a.id,))
+                )
+        build.assert_not_called()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RecipeTagsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author'
+        )
+        cls.token = Token.objects.create(user=cls.author)
+        cls.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+        cls.breakfast = Tag.objects.create(name='Завтрак', slug='breakfast')
+        cls.lunch = Tag.objects.create(name='Обед', slug='lunch')
+        cls.dinner = Tag.objects.create(name='Ужин', slug='dinner')
+        cls.recipes = {}
+        for name, tags in (
+            ('morning', (cls.breakfast,)),
+            ('all-day', (cls.breakfast, cls.lunch, cls.dinner)),
+            ('evening', (cls.dinner,)), ('untagged', ()),
+        ):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=name, text='Описание',
+                cooking_time=10, image='recipes/test.png'
+            )
+            recipe.tags.set(tags)
+            cls.recipes[name] = recipe
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        tag_catalog.invalidate()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def names(self, *slugs):
+        response = APIClient().get('/api/recipes/', {'tags': slugs})
+        self.assertEqual(response.status_code, 200)
+        return sorted(recipe['name'] for recipe in response.json()['results'])
+
+    def test_bits_and_masks(self):
+        self.assertEqual(
+            sorted(Tag.objects.values_list('bit', flat=True)), [0, 1, 2]
+        )
+        self.recipes['all-day'].refresh_from_db()
+        self.assertEqual(
+            self.recipes['all-day'].tag_mask,
+            self.breakfast.mask | self.lunch.mask | self.dinner.mask
+        )
+
+    def test_filter_by_any_tag(self):
+        self.assertEqual(self.names('breakfast'), ['all-day', 'morning'])
+        self.assertEqual(
+            self.names('lunch', 'dinner'), ['all-day', 'evening']
+        )
+        self.assertEqual(self.names('unknown'), [])
+        self.assertEqual(len(self.names()), 4)
+
+    def test_tags_in_response(self):
+        response = APIClient().get(
+            f'/api/recipes/{self.recipes["all-day"].id}/'
+        )
+        self.assertEqual(
+            [tag['slug'] for tag in response.json()['tags']],
+            ['breakfast', 'lunch', 'dinner']
+        )
+        response = APIClient().get('/api/tags/')
+        self.assertEqual(response.json(), [
+            {'id': tag.id, 'name': tag.name, 'slug': tag.slug}
+            for tag in (self.breakfast, self.lunch, self.dinner)
+        ])
+
+    def test_recipe_write_sets_tags(self):
+        buffer = BytesIO()
+        Image.new('RGB', (4, 4)).save(buffer, format='PNG')
+        image = base64.b64encode(buffer.getvalue()).decode()
+        response = self.client.post('/api/recipes/', {
+            'name': 'new', 'text': 'Описание', 'cooking_time': 5,
+            'image': f'data:image/png;base64,{image}',
+            'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+            'tags': [self.lunch.id],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(
+            [tag['slug'] for tag in response.json()['tags']], ['lunch']
+        )
+        self.assertEqual(self.names('lunch'), ['all-day', 'new'])
+
+        response = self.client.patch(
+            f'/api/recipes/{self.recipes["morning"].id}/', {
+                'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+                'tags': [self.dinner.id],
+            }, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.names('breakfast'), ['all-day'])
+        self.assertEqual(
+            self.names('dinner'), ['all-day', 'evening', 'morning']
+        )
+
+    def test_tag_delete_clears_bit(self):
+        self.dinner.delete()
+        self.assertEqual(self.names('breakfast'), ['all-day', 'morning'])
+        self.recipes['evening'].refresh_from_db()
+        self.assertEqual(self.recipes['evening'].tag_mask, 0)
+        self.breakfast.recipes.clear()
+        self.recipes['all-day'].refresh_from_db()
+        self.assertEqual(self.recipes['all-day'].tag_mask, self.lunch.mask)
+
+
+class ConditionalGetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author'
+        )
+        cls.viewer = User.objects.create(
+            email='viewer@example.com', username='viewer',
+            first_name='Viewer', last_name='Viewer'
+        )
+        cls.token = Token.objects.create(user=cls.viewer)
+        cls.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Блины', text='Описание',
+            cooking_time=10, image='recipes/test.png'
+        )
+        RecipeIngredient.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=100
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.url = f'/api/recipes/{self.recipe.id}/'
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def revalidate(self, client, url, response):
+        return client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_detail_not_modified(self):
+        response = APIClient().get(self.url)
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertIn('Authorization', response['Vary'])
+        not_modified = self.revalidate(APIClient(), self.url, response)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(APIClient().get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        ).status_code, 304)
+
+    def test_detail_changes_with_recipe(self):
+        response = APIClient().get(self.url)
+        self.ingredient.name = 'Мука пшеничная'
+        self.ingredient.save()
+        self.assertEqual(
+            self.revalidate(APIClient(), self.url, response).status_code, 200
+        )
+        response = APIClient().get(self.url)
+        self.recipe.cooking_time = 20
+        self.recipe.save()
+        changed = self.revalidate(APIClient(), self.url, response)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()['cooking_time'], 20)
+
+    def test_viewer_flags_change_etag(self):
+        response = self.client.get(self.url)
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(
+            self.revalidate(self.client, self.url, response).status_code, 304
+        )
+        Favorite.objects.create(user=self.viewer, recipe=self.recipe)
+        response = self.revalidate(self.client, self.url, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_favorited'])
+        # Чужой ETag не подходит: флаги у пользователей разные
+        self.assertEqual(
+            self.revalidate(APIClient(), self.url, response).status_code, 200
+        )
+
+    def test_counters_change_last_modified(self):
+        past = timezone.now() - timedelta(hours=1)
+        Recipe.objects.filter(pk=self.recipe.pk).update(updated_at=past)
+        User.objects.filter(pk=self.author.pk).update(updated_at=past)
+        cache.set(changed_key(User), int(past.timestamp()), None)
+        since = APIClient().get(self.url)['Last-Modified']
+        self.assertEqual(APIClient().get(
+            self.url, HTTP_IF_MODIFIED_SINCE=since
+        ).status_code, 304)
+        # Счётчик меняется UPDATE с F() и не трогает updated_at
+        self.client.post(f'/api/recipes/{self.recipe.id}/favorite/')
+        response = APIClient().get(self.url, HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['favorites_count'], 1)
+
+    def test_list_not_modified(self):
+        url = '/api/recipes/?limit=6'
+        response = APIClient().get(url)
+        self.assertEqual(
+            self.revalidate(APIClient(), url, response).status_code, 304
+        )
+        self.assertEqual(APIClient().get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        ).status_code, 304)
+        Recipe.objects.create(
+            author=self.author, name='Оладьи', text='Описание',
+            cooking_time=10, image='recipes/test.png'
+        )
+        self.assertEqual(
+            self.revalidate(APIClient(), url, response).status_code, 200
+        )
+
+
+class RecipeFragmentTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author'
+        )
+        cls.viewer = User.objects.create(
+            email='viewer@example.com', username='viewer',
+            first_name='Viewer', last_name='Viewer'
+        )
+        cls.token = Token.objects.create(user=cls.viewer)
+        cls.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+        cls.recipes = []
+        for name in ('Блины', 'Оладьи'):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=name, text='Описание',
+                cooking_time=10, image='recipes/test.png'
+            )
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=cls.ingredient, amount=100
+            )
+            cls.recipes.append(recipe)
+        Favorite.objects.create(user=cls.viewer, recipe=cls.recipes[0])
+        Subscription.objects.create(user=cls.viewer, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def counters(self):
+        counters = registry.snapshot()['counters']
+        return (
+            counters.get('recipe_fragments.hits', 0),
+            counters.get('recipe_fragments.misses', 0),
+        )
+
+    def detail(self, client=None):
+        return (client or APIClient()).get(
+            f'/api/recipes/{self.recipes[0].id}/'
+        ).json()
+
+    def test_fragments_are_shared_between_viewers(self):
+        anonymous = APIClient().get('/api/recipes/').json()['results']
+        self.assertEqual(self.counters(), (0, 2))
+        personal = self.client.get('/api/recipes/').json()['results']
+        self.assertEqual(self.counters(), (2, 2))
+        self.assertFalse(any(
+            recipe['is_favorited'] or recipe['author']['is_subscribed']
+            for recipe in anonymous
+        ))
+        flags = {
+            recipe['name']: recipe['is_favorited'] for recipe in personal
+        }
+        self.assertEqual(flags, {'Блины': True, 'Оладьи': False})
+        self.assertTrue(all(
+            recipe['author']['is_subscribed'] for recipe in personal
+        ))
+        self.assertEqual(self.detail(self.client), personal[1])
+        self.assertEqual(self.counters(), (3, 2))
+
+    def test_fragments_follow_changes(self):
+        self.detail()
+        RecipeIngredient.objects.filter(recipe=self.recipes[0]).update(
+            amount=1
+        )
+        # Обновление без сигналов видно только после смены версии
+        self.assertEqual(self.detail()['ingredients'][0]['amount'], 100)
+
+        link = RecipeIngredient.objects.get(recipe=self.recipes[0])
+        link.amount = 250
+        link.save()
+        self.assertEqual(self.detail()['ingredients'][0]['amount'], 250)
+
+        self.author.first_name = 'Renamed'
+        self.author.save()
+        self.assertEqual(self.detail()['author']['first_name'], 'Renamed')
+
+        self.recipes[0].name = 'Блинчики'
+        self.recipes[0].save()
+        self.assertEqual(self.detail()['name'], 'Блинчики')
+
+
+class EngagementCountersTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author'
+        )
+        cls.viewer = User.objects.create(
+            email='viewer@example.com', username='viewer',
+            first_name='Viewer', last_name='Viewer'
+        )
+        cls.token = Token.objects.create(user=cls.viewer)
+        cls.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.author, name=name, text='Описание',
+                cooking_time=10, image='recipes/test.png'
+            )
+            for name in ('Блины', 'Оладьи', 'Сырники')
+        ]
+        for recipe in cls.recipes:
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=cls.ingredient, amount=100
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def counters(self, obj, *fields):
+        obj.refresh_from_db(fields=fields)
+        return tuple(getattr(obj, field) for field in fields)
+
+    def test_counters_follow_api_writes(self):
+        recipe = self.recipes[0]
+        self.assertEqual(self.counters(self.author, 'recipes_count'), (3,))
+        self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assertEqual(
+            self.counters(recipe, 'favorites_count', 'in_carts_count'),
+            (1, 1)
+        )
+        data = self.client.get(f'/api/recipes/{recipe.id}/').json()
+        self.assertEqual(data['favorites_count'], 1)
+        self.assertEqual(data['author']['recipes_count'], 3)
+
+        self.client.delete(f'/api/recipes/{recipe.id}/favorite/')
+        self.client.delete(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assertEqual(
+            self.counters(recipe, 'favorites_count', 'in_carts_count'),
+            (0, 0)
+        )
+
+        self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(self.counters(self.author, 'subscribers_count'), (1,))
+        self.recipes[2].delete()
+        self.assertEqual(self.counters(self.author, 'recipes_count'), (2,))
+
+    def test_save_keeps_concurrent_increments(self):
+        recipe = Recipe.objects.get(pk=self.recipes[0].pk)
+        Favorite.objects.create(user=self.viewer, recipe=recipe)
+        recipe.name = 'Блинчики'
+        recipe.save()
+        self.assertEqual(self.counters(recipe, 'favorites_count'), (1,))
+
+    def test_reconcile_and_ordering(self):
+        Favorite.objects.bulk_create(
+            Favorite(user=user, recipe=self.recipes[1])
+            for user in (self.author, self.viewer)
+        )
+        Favorite.objects.create(user=self.viewer, recipe=self.recipes[2])
+        Recipe.objects.filter(pk=self.recipes[0].pk).update(
+            favorites_count=7
+        )
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('recipe.favorites_count: исправлено 2', out.getvalue())
+
+        response = APIClient().get('/api/recipes/?ordering=-favorites_count')
+        self.assertEqual(
+            [recipe['name'] for recipe in response.json()['results']],
+            ['Оладьи', 'Сырники', 'Блины']
+        )
+        response = APIClient().get('/api/users/?ordering=-recipes_count')
+        self.assertEqual(response.json()['results'][0]['id'], self.author.id)
+
+
+class RecipePopularityTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author'
+        )
+        cls.users = [
+            User.objects.create(
+                email=f'user{index}@example.com', username=f'user{index}',
+                first_name='User', last_name='User'
+            )
+            for index in range(3)
+        ]
+        cls.recipes = {
+            name: Recipe.objects.create(
+                author=cls.author, name=name, text='Описание',
+                cooking_time=10, image='recipes/test.png'
+            )
+            for name in ('Блины', 'Оладьи', 'Сырники')
+        }
+
+    def setUp(self):
+        cache.clear()
+
+    def names(self, url):
+        return [
+            recipe['name']
+            for recipe in APIClient().get(url).json()['results']
+        ]
+
+    def test_old_engagement_decays_faster_for_trending(self):
+        now = timezone.now()
+        # Блины добавляли давно, но часто; Оладьи — один раз сегодня
+        for user in self.users:
+            Favorite.objects.create(
+                user=user, recipe=self.recipes['Блины'],
+                created_at=now - timedelta(days=20)
+            )
+        Favorite.objects.create(
+            user=self.users[0], recipe=self.recipes['Оладьи'], created_at=now
+        )
+        out = StringIO()
+        call_command('refresh_popularity', stdout=out)
+        self.assertIn('Пересчитано рецептов: 2', out.getvalue())
+
+        self.assertEqual(
+            self.names('/api/recipes/?ordering=popular'),
+            ['Блины', 'Оладьи', 'Сырники']
+        )
+        self.assertEqual(
+            self.names('/api/recipes/?ordering=trending'),
+            ['Оладьи', 'Блины', 'Сырники']
+        )
+        self.assertEqual(
+            self.names('/api/recipes/?ordering=trending&limit=2&cursor='),
+            ['Оладьи', 'Блины']
+        )
+
+    def test_incremental_refresh(self):
+        Favorite.objects.create(
+            user=self.users[0], recipe=self.recipes['Блины']
+        )
+        call_command('refresh_popularity', stdout=StringIO())
+        Favorite.objects.create(
+            user=self.users[0], recipe=self.recipes['Сырники']
+        )
+        Favorite.objects.filter(recipe=self.recipes['Блины']).delete()
+        out = StringIO()
+        call_command('refresh_popularity', stdout=out)
+        self.assertIn('Пересчитано рецептов: 2', out.getvalue())
+        self.assertEqual(
+            self.names('/api/recipes/?ordering=popular')[0], 'Сырники'
+        )
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipes['Блины'].pk).popular_score, 0
+        )
+
+
+class SubscriptionFeedTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create(
+            email='reader@example.com', username='reader',
+            first_name='Reader', last_name='Reader'
+        )
+        cls.token = Token.objects.create(user=cls.reader)
+        cls.authors = [
+            User.objects.create(
+                email=f'author{index}@example.com', username=f'author{index}',
+                first_name='Author', last_name=str(index)
+            )
+            for index in range(2)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def publish(self, author, name):
+        return Recipe.objects.create(
+            author=author, name=name, text='Описание', cooking_time=10,
+            image='recipes/test.png'
+        )
+
+    def feed(self, url='/api/users/feed/?limit=2'):
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            names += [recipe['name'] for recipe in data['results']]
+            url = data['next']
+        return names
+
+    def test_fanout_backfill_and_cleanup(self):
+        first, second = self.authors
+        self.publish(first, 'Блины')
+        self.client.post(f'/api/users/{first.id}/subscribe/')
+        self.client.post(f'/api/users/{second.id}/subscribe/')
+        self.assertEqual(
+            FeedEntry.objects.filter(user=self.reader).count(), 1
+        )
+        self.publish(second, 'Оладьи')
+        self.publish(first, 'Сырники')
+        self.publish(self.reader, 'Свой рецепт')
+        self.assertEqual(self.feed(), ['Сырники', 'Оладьи', 'Блины'])
+        self.assertEqual(
+            self.client.get('/api/users/feed/').json()['results'][0]['author'][
+                'is_subscribed'
+            ],
+            True
+        )
+
+        self.client.delete(f'/api/users/{first.id}/subscribe/')
+        self.assertEqual(self.feed(), ['Оладьи'])
+        self.assertEqual(
+            APIClient().get('/api/users/feed/').status_code, 401
+        )
+
+    @override_settings(FEED_FANOUT_MAX_RECIPES=1, QUERY_BUDGET_MODE='raise')
+    def test_feed_query_budget(self):
+        prolific, regular = self.authors
+        self.publish(prolific, 'Блины')
+        self.publish(prolific, 'Оладьи')
+        self.publish(regular, 'Сырники')
+        self.client.post(f'/api/users/{prolific.id}/subscribe/')
+        self.client.post(f'/api/users/{regular.id}/subscribe/')
+        # Входящие и рецепты вне входящих читаются при холодном кэше тегов;
+        # превышение бюджета users-feed выбросит QueryBudgetExceeded
+        counts = []
+        for limit in (1, 10):
+            cache.clear()
+            tag_catalog.invalidate()
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(f'/api/users/feed/?limit={limit}')
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(context))
+        self.assertEqual(counts[0], counts[1])
+
+    @override_settings(FEED_FANOUT_MAX_RECIPES=1)
+    def test_prolific_authors_are_merged_on_read(self):
+        prolific, regular = self.authors
+        self.publish(prolific, 'Блины')
+        self.publish(prolific, 'Оладьи')
+        self.client.post(f'/api/users/{prolific.id}/subscribe/')
+        self.client.post(f'/api/users/{regular.id}/subscribe/')
+        self.publish(regular, 'Сырники')
+        self.publish(prolific, 'Вафли')
+        self.assertEqual(
+            list(FeedEntry.objects.filter(user=self.reader).values_list(
+                'recipe__name', flat=True
+            )),
+            ['Сырники']
+        )
+        self.assertEqual(
+            self.feed(), ['Вафли', 'Сырники', 'Оладьи', 'Блины']
+        )
+
+        # После удаления рецептов автор снова раскладывается по входящим
+        Recipe.objects.filter(name__in=('Вафли', 'Оладьи')).delete()
+        self.assertEqual(
+            set(FeedEntry.objects.filter(user=self.reader).values_list(
+                'recipe__name', flat=True
+            )),
+            {'Сырники', 'Блины'}
+        )
+        self.assertEqual(self.feed(), ['Сырники', 'Блины'])
+
+
+class ShoppingListTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            email='user@example.com', username='user',
+            first_name='User', last_name='User'
+        )
+        cls.token = Token.objects.create(user=cls.user)
+        author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author'
+        )
+        cls.flour, cls.milk = Ingredient.objects.bulk_create([
+            Ingredient(name='мука', measurement_unit='г'),
+            Ingredient(name='молоко', measurement_unit='мл'),
+        ])
+        cls.pancakes = Recipe.objects.create(
+            author=author, name='Блины', text='Описание',
+            cooking_time=10, image='recipes/test.png'
+        )
+        cls.bread = Recipe.objects.create(
+            author=author, name='Хлеб', text='Описание',
+            cooking_time=60, image='recipes/test.png'
+        )
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=cls.pancakes, ingredient=cls.flour,
+                             amount=200),
+            RecipeIngredient(recipe=cls.pancakes, ingredient=cls.milk,
+                             amount=500),
+            RecipeIngredient(recipe=cls.bread, ingredient=cls.flour,
+                             amount=300),
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def totals(self):
+        return dict(self.user.shopping_list.values_list(
+            'ingredient__name', 'amount'
+        ))
+
+    def test_list_follows_cart(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.pancakes)
+        ShoppingCart.objects.create(user=self.user, recipe=self.bread)
+        self.assertEqual(self.totals(), {'мука': 500, 'молоко': 500})
+
+        ShoppingCart.objects.filter(recipe=self.pancakes).delete()
+        self.assertEqual(self.totals(), {'мука': 300})
+
+        self.bread.delete()
+        self.assertEqual(self.totals(), {})
+
+    def test_download_is_single_read(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.pancakes)
+        ShoppingCart.objects.create(user=self.user, recipe=self.bread)
+        # Токен и чтение списка
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/recipes/download_shopping_cart/')
+        content = b''.join(response).decode()
+        self.assertIn('мука — 500 г', content)
+        self.assertIn('молоко — 500 мл', content)
+
+    def test_empty_cart(self):
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rebuild_command(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.pancakes)
+        self.user.shopping_list.update(amount=1)
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        self.assertEqual(self.totals(), {'мука': 200, 'молоко': 500})
+
+
+class BulkEngagementTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            email='user@example.com', username='user',
+            first_name='User', last_name='User'
+        )
+        cls.token = Token.objects.create(user=cls.user)
+        cls.author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author'
+        )
+        cls.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {index}', text='Описание',
+                cooking_time=10, image='recipes/test.png'
+            )
+            for index in range(6)
+        ]
+        for recipe in cls.recipes:
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=cls.flour, amount=100
+            )
+        cls.own = Recipe.objects.create(
+            author=cls.user, name='Свой', text='Описание',
+            cooking_time=10, image='recipes/test.png'
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def ids(self, *indexes):
+        return [self.recipes[index].id for index in indexes]
+
+    def counters(self, field):
+        return [
+            getattr(recipe, field)
+            for recipe in Recipe.objects.filter(author=self.author)
+            .order_by('id')
+        ]
+
+    def flour_total(self):
+        item = self.user.shopping_list.filter(ingredient=self.flour).first()
+        return item.amount if item else 0
+
+    def test_bulk_add_reports_each_id(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipes[0])
+        response = self.client.post(
+            '/api/recipes/favorite/bulk/',
+            {'recipes': [*self.ids(0, 1, 2), self.own.id, 999999]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['status'] for item in response.json()['results']],
+            ['already_added', 'added', 'added', 'own_recipe', 'not_found']
+        )
+        self.assertEqual(self.counters('favorites_count'), [1, 1, 1, 0, 0, 0])
+
+        response = self.client.delete(
+            '/api/recipes/favorite/bulk/', {'recipes': self.ids(1, 3)},
+            format='json'
+        )
+        self.assertEqual(
+            [item['status'] for item in response.json()['results']],
+            ['removed', 'not_added']
+        )
+        self.assertEqual(self.counters('favorites_count'), [1, 0, 1, 0, 0, 0])
+        self.assertEqual(
+            self.client.post(
+                '/api/recipes/favorite/bulk/', {'recipes': []}, format='json'
+            ).status_code,
+            400
+        )
+
+    def test_bulk_cost_does_not_depend_on_size(self):
+        def queries(indexes):
+            with CaptureQueriesContext(connection) as context:
+                self.client.post(
+                    '/api/recipes/shopping_cart/bulk/',
+                    {'recipes': self.ids(*indexes)}, format='json'
+                )
+            return len(context.captured_queries)
+
+        self.assertEqual(queries([0]), queries([1, 2, 3, 4, 5]))
+        self.assertEqual(self.counters('in_carts_count'), [1] * 6)
+        self.assertEqual(self.flour_total(), 600)
+
+    def test_favorites_to_cart_and_clear(self):
+        for recipe in self.recipes[:3]:
+            Favorite.objects.create(user=self.user, recipe=recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipes[0])
+        response = self.client.post(
+            '/api/recipes/shopping_cart/from_favorites/'
+        )
+        self.assertEqual(response.json(), {'added': 2})
+        self.assertEqual(self.counters('in_carts_count'), [1, 1, 1, 0, 0, 0])
+        self.assertEqual(self.flour_total(), 300)
+
+        response = self.client.delete('/api/recipes/shopping_cart/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(ShoppingCart.objects.filter(user=self.user).exists())
+        self.assertEqual(self.counters('in_carts_count'), [0] * 6)
+        self.assertEqual(self.flour_total(), 0)
+
+
+class ShortLinkTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/test.png'
+        )
+        cls.legacy = Recipe.objects.create(
+            author=author, name='Старый рецепт', text='Описание',
+            cooking_time=10, image='recipes/test.png',
+            short_link=f'{Recipe.DOMAIN}AbCdEfGh'
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_short_link_resolves_to_recipe(self):
+        link = self.client.get(
+            f'/api/recipes/{self.recipe.id}/get-link/'
+        ).json()['short-link']
+        path = urlsplit(link).path
+        response = self.client.get(path)
+        self.assertRedirects(
+            response, f'/recipes/{self.recipe.id}',
+            fetch_redirect_response=False
+        )
+        with self.assertNumQueries(0):
+            self.client.get(path)
+
+    def test_legacy_link_still_resolves(self):
+        link = self.client.get(
+            f'/api/recipes/{self.legacy.id}/get-link/'
+        ).json()['short-link']
+        self.assertEqual(link, self.legacy.short_link)
+        response = self.client.get(urlsplit(link).path)
+        self.assertRedirects(
+            response, f'/recipes/{self.legacy.id}',
+            fetch_redirect_response=False
+        )
+
+    def test_unknown_code(self):
+        self.assertEqual(self.client.get('/s/zzzzzz/').status_code, 404)
+        self.assertEqual(self.client.get('/zzzzzzzz').status_code, 404)
+
+    def test_deleted_recipe_is_forgotten_in_shared_cache(self):
+        paths = [
+            urlsplit(recipe.get_short_link()).path
+            for recipe in (self.recipe, self.legacy)
+        ]
+        for path in paths:
+            self.assertEqual(self.client.get(path).status_code, 302)
+        keys = [
+            short_code_key(code)
+            for recipe in (self.recipe, self.legacy)
+            for code in recipe.short_codes()
+        ]
+        # Другие процессы видят тот же кэш, а не свой lru_cache
+        self.assertEqual(
+            set(cache.get_many(keys).values()),
+            {self.recipe.id, self.legacy.id}
+        )
+        self.recipe.delete()
+        self.legacy.delete()
+        self.assertEqual(cache.get_many(keys), {})
+        for path in paths:
+            self.assertEqual(self.client.get(path).status_code, 404)
+
+
+class RecipeWriteTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            email='user@example.com', username='user',
+            first_name='User', last_name='User'
+        )
+        cls.token = Token.objects.create(user=cls.user)
+        cls.flour, cls.milk, cls.eggs, cls.sugar = (
+            Ingredient.objects.bulk_create(
+                Ingredient(name=name, measurement_unit='г')
+                for name in ('мука', 'молоко', 'яйца', 'сахар')
+            )
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Блины', text='Описание',
+            cooking_time=10, image='recipes/test.png'
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=self.recipe, ingredient=ingredient,
+                             amount=amount)
+            for ingredient, amount in (
+                (self.flour, 100), (self.milk, 200), (self.eggs, 300)
+            )
+        )
+
+    def patch(self, ingredients, **data):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.id}/',
+                {'ingredients': [
+                    {'id': ingredient.id, 'amount': amount}
+                    for ingredient, amount in ingredients
+                ], **data},
+                format='json'
+            )
+        return response, [query['sql'] for query in context.captured_queries]
+
+    def rows(self):
+        return dict(RecipeIngredient.objects.filter(
+            recipe=self.recipe
+        ).values_list('ingredient__name', 'amount'))
+
+    def test_title_only_update_keeps_rows(self):
+        before = set(RecipeIngredient.objects.values_list('pk', flat=True))
+        response, queries = self.patch(
+            [(self.flour, 100), (self.milk, 200), (self.eggs, 300)],
+            name='Блинчики'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['name'], 'Блинчики')
+        self.assertEqual(len(response.json()['ingredients']), 3)
+        self.assertEqual(
+            set(RecipeIngredient.objects.values_list('pk', flat=True)), before
+        )
+        self.assertFalse([
+            sql for sql in queries
+            if 'api_recipeingredient' in sql
+            and not sql.startswith('SELECT')
+        ])
+        # Ингредиенты уже загружены вместе с рецептом в get_object
+        self.assertEqual(
+            len([sql for sql in queries if 'FROM "api_ingredient"' in sql]), 1
+        )
+
+    def test_update_writes_only_changes(self):
+        milk = RecipeIngredient.objects.get(
+            recipe=self.recipe, ingredient=self.milk
+        )
+        response, queries = self.patch(
+            [(self.milk, 200), (self.eggs, 350), (self.sugar, 50)]
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            self.rows(), {'молоко': 200, 'яйца': 350, 'сахар': 50}
+        )
+        self.assertTrue(RecipeIngredient.objects.filter(pk=milk.pk).exists())
+        self.assertEqual(
+            {
+                item['name']: item['amount']
+                for item in response.json()['ingredients']
+            },
+            self.rows()
+        )
+        writes = [
+            sql.split()[0] for sql in queries
+            if 'api_recipeingredient' in sql and not sql.startswith('SELECT')
+        ]
+        self.assertEqual(sorted(writes), ['DELETE', 'INSERT', 'UPDATE'])
+        # Ответ собирается из записанных строк без повторного чтения
+        last_write = max(
+            index for index, sql in enumerate(queries)
+            if 'api_recipeingredient' in sql and not sql.startswith('SELECT')
+        )
+        self.assertFalse([
+            sql for sql in queries[last_write:]
+            if sql.startswith('SELECT') and 'api_recipeingredient' in sql
+        ])
+
+    def test_unknown_ingredient_is_rejected(self):
+        response, _ = self.patch([(self.flour, 100)], name='Блинчики')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {'ingredients': [{'id': 999999, 'amount': 1}]}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('999999', str(response.json()['ingredients']))
+        self.assertEqual(self.rows(), {'мука': 100})
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RecipeImageUploadTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            email='user@example.com', username='user',
+            first_name='User', last_name='User'
+        )
+        cls.token = Token.objects.create(user=cls.user)
+        cls.ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    @staticmethod
+    def png(size=(4, 4)):
+        buffer = BytesIO()
+        Image.new('RGB', size).save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def recipe_data(self, **extra):
+        data = {
+            'name': 'Блины', 'text': 'Описание', 'cooking_time': 10,
+            'ingredients': [{'id': self.ingredient.id, 'amount': 200}],
+        }
+        data.update(extra)
+        return data
+
+    def test_base64_upload(self):
+        image = 'data:image/png;base64,' + base64.b64encode(
+            self.png()
+        ).decode()
+        response = self.client.post(
+            '/api/recipes/', self.recipe_data(image=image), format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertTrue(response.json()['image'].endswith('.png'))
+
+    def test_write_response_counts_new_recipe(self):
+        image = 'data:image/png;base64,' + base64.b64encode(
+            self.png()
+        ).decode()
+        response = self.client.post(
+            '/api/recipes/', self.recipe_data(image=image), format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['author']['recipes_count'], 1)
+
+    def test_multipart_upload(self):
+        data = self.recipe_data(
+            image=SimpleUploadedFile(
+                'cake.png', self.png(), content_type='image/png'
+            )
+        )
+        data['ingredients'] = json.dumps(data['ingredients'])
+        response = self.client.post('/api/recipes/', data, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(len(response.json()['ingredients']), 1)
+
+    def test_path_string_is_rejected(self):
+        for value in ('/dev/zero', 'recipes/test.png'):
+            with mock.patch(
+                'core.fields.get_image_dimensions'
+            ) as dimensions:
+                response = self.client.post(
+                    '/api/recipes/', self.recipe_data(image=value),
+                    format='json'
+                )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('image', response.json())
+            dimensions.assert_not_called()
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=100)
+    def test_size_limit_is_checked_before_decoding(self):
+        image = 'data:image/png;base64,' + 'A' * 1000
+        response = self.client.post(
+            '/api/recipes/', self.recipe_data(image=image), format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.json())
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=100)
+    def test_pixel_limit(self):
+        image = 'data:image/png;base64,' + base64.b64encode(
+            self.png((20, 20))
+        ).decode()
+        response = self.client.post(
+            '/api/recipes/', self.recipe_data(image=image), format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(IMAGE_VARIANT_WORKERS=0)
+    def test_image_variants(self):
+        image = 'data:image/png;base64,' + base64.b64encode(
+            self.png((800, 600))
+        ).decode()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.client.post(
+                '/api/recipes/', self.recipe_data(image=image), format='json'
+            )
+        variants = response.json()['image_variants']
+        self.assertEqual(variants['card']['webp'], response.json()['image'])
+        self.assertIsNone(variants['placeholder'])
+
+        for callback in callbacks:
+            callback()
+        recipe_id = response.json()['id']
+        variants = self.client.get(
+            f'/api/recipes/{recipe_id}/'
+        ).json()['image_variants']
+        self.assertTrue(variants['card']['webp'].endswith('card.webp'))
+        self.assertTrue(variants['thumbnail']['jpeg'].endswith('.jpeg'))
+        self.assertTrue(variants['placeholder'].startswith('data:image/'))
+        card = Recipe.objects.get(pk=recipe_id).image_variants
+        path = os.path.join(settings.MEDIA_ROOT, card['files']['card']['jpeg'])
+        with Image.open(path) as image:
+            self.assertEqual(image.size, (480, 360))
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=10)
+    def test_large_base64_is_streamed_to_disk(self):
+        image = 'data:image/png;base64,' + base64.b64encode(
+            self.png((64, 64))
+        ).decode()
+        response = self.client.put(
+            '/api/users/me/avatar/', {'avatar': image}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.avatar.name.endswith('.png'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class ReplicaRoutingTest(TestCase):
+
+    def route(self, method, write=False, cookies=None):
+        router = PrimaryReplicaRouter()
+        routes = []
+
+        def view(request):
+            routes.append(router.db_for_read(Recipe))
+            if write:
+                router.db_for_write(Recipe)
+                routes.append(router.db_for_read(Recipe))
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method)('/api/recipes/')
+        request.COOKIES.update(cookies or {})
+        response = ReplicaRoutingMiddleware(view)(request)
+        return routes, response
+
+    def test_safe_requests_read_from_replica(self):
+        routes, response = self.route('get')
+        self.assertEqual(routes, ['replica_1'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_reads_after_write_use_primary(self):
+        routes, response = self.route('get', write=True)
+        self.assertEqual(routes, ['replica_1', 'default'])
+
+    def test_unsafe_requests_pin_the_client(self):
+        routes, response = self.route('post')
+        self.assertEqual(routes, ['default'])
+        self.assertIn(PIN_COOKIE, response.cookies)
+        routes, _ = self.route('get', cookies={PIN_COOKIE: '1'})
+        self.assertEqual(routes, ['default'])
+
+    def test_outside_requests_use_primary(self):
+        self.assertEqual(PrimaryReplicaRouter().db_for_read(Recipe), 'default')
+
+
+@override_settings(DATABASE_REPLICAS=['lagging'])
+class ReplicaRebuildTest(TestCase):
+    """Общие для процесса данные не собираются с отставшей реплики."""
+    # Реплика подключается в setUpClass, до проверки списка баз
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # Реплика с пустыми таблицами: изменения до неё ещё не дошли
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.settings['lagging'] = {
+            **connections.settings['default'],
+            'NAME': os.path.join(cls.replica_dir, 'lagging.sqlite3'),
+        }
+        with connections['lagging'].schema_editor() as editor:
+            for model in (Recipe, RecipeIngredient):
+                editor.create_model(model)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['lagging'].close()
+        del connections['lagging']
+        del connections.settings['lagging']
+        shutil.rmtree(cls.replica_dir, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author'
+        )
+        cls.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=author, name='Блины', text='Описание',
+            cooking_time=10, image='recipes/test.png'
+        )
+        RecipeIngredient.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=100
+        )
+
+    def setUp(self):
+        cache.clear()
+        recipe_ingredient_index.invalidate()
+        token = use_replicas.set(True)
+        self.addCleanup(use_replicas.reset, token)
+
+    def test_reads_in_request_go_to_replica(self):
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_index_rebuild_reads_primary(self):
+        self.assertEqual(
+            recipe_ingredient_index.match(has_all=(self.ingredient.id,)),
+            [self.recipe.id]
+        )
+
+    def test_paginated_count_reads_primary(self):
+        pagination = CustomPagination()
+        pagination.request = Request(RequestFactory().get('/api/recipes/'))
+        self.assertEqual(pagination.get_count(Recipe.objects.all()), 1)
+
+
+class ServerTimingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author'
+        )
+        cls.staff = User.objects.create(
+            email='staff@example.com', username='staff',
+            first_name='Staff', last_name='Staff', is_staff=True
+        )
+        Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/test.png'
+        )
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+
+    def test_header_reports_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/')
+        self.assertIn(
+            f'desc="{len(context.captured_queries)} queries"',
+            response['Server-Timing']
+        )
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+        stats = registry.snapshot()['routes']['recipes-list']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['latency_ms']['+Inf'], 1)
+        self.assertGreater(stats['serialize_ms_avg'], 0)
+
+    def test_metrics_are_staff_only(self):
+        self.client.get('/api/recipes/')
+        client = APIClient()
+        self.assertEqual(client.get('/api/metrics/').status_code, 401)
+        client.force_authenticate(self.author)
+        self.assertEqual(client.get('/api/metrics/').status_code, 403)
+        client.force_authenticate(self.staff)
+        data = client.get('/api/metrics/').json()
+        self.assertEqual(data['routes']['recipes-list']['requests'], 1)
+
+    @override_settings(
+        QUERY_BUDGETS={'recipes-list': {'GET': 1}}, QUERY_BUDGET_MODE='log'
+    )
+    def test_budget_overrun_is_logged(self):
+        with self.assertLogs('core.middleware', 'WARNING'):
+            self.assertEqual(self.client.get('/api/recipes/').status_code, 200)
+        stats = registry.snapshot()['routes']['recipes-list']
+        self.assertEqual(stats['over_budget'], 1)
+
+    @override_settings(
+        QUERY_BUDGETS={'recipes-list': 1}, QUERY_BUDGET_MODE='raise'
+    )
+    def test_budget_overrun_can_fail(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get('/api/recipes/')
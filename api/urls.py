@@ -1,5 +1,6 @@
-from django.urls import path
-from api.views import IngredientViewSet, RecipeViewSet, RecipeShortLinkViewSet, ShoppingCartViewSet, FavoriteViewSet
+from django.urls import path, re_path
+from api.feed import FeedPagination
+from api.views import IngredientViewSet, RecipeViewSet, TagViewSet, RecipeShortLinkViewSet, ShoppingCartViewSet, FavoriteViewSet, metrics, short_link_redirect
 
 urlpatterns = [
     # Ingredients endpoints
@@ -9,8 +10,26 @@ urlpatterns = [
     path('api/ingredients/<pk>/',
          IngredientViewSet.as_view({'get': 'retrieve'}),
          name='ingredients-detail'),
+    # Tags endpoints
+    path('api/tags/', TagViewSet.as_view({'get': 'list'}), name='tags-list'),
+    path('api/tags/<pk>/', TagViewSet.as_view({'get': 'retrieve'}),
+         name='tags-detail'),
     # Recipes endpoints
 
+    # Массовые операции с корзиной и избранным
+    path('api/recipes/shopping_cart/',
+         ShoppingCartViewSet.as_view({'delete': 'clear'}),
+         name='shopping-cart-clear'),
+    path('api/recipes/shopping_cart/bulk/',
+         ShoppingCartViewSet.as_view({'post': 'bulk', 'delete': 'bulk'}),
+         name='shopping-cart-bulk'),
+    path('api/recipes/shopping_cart/from_favorites/',
+         ShoppingCartViewSet.as_view({'post': 'from_favorites'}),
+         name='shopping-cart-from-favorites'),
+    path('api/recipes/favorite/bulk/',
+         FavoriteViewSet.as_view({'post': 'bulk', 'delete': 'bulk'}),
+         name='favorite-bulk'),
+
     path('api/recipes/download_shopping_cart/',
          ShoppingCartViewSet.as_view({'get': 'download_shopping_cart'}),
          name='get-shopping-cart'),
@@ -34,4 +53,15 @@ urlpatterns = [
     path('api/recipes/',
          RecipeViewSet.as_view({'get': 'list', 'post': 'create'}),
          name='recipes-list'),
+    # Лента подписок; объявлена до users.urls, где api/users/<pk>/
+    path('api/users/feed/',
+         RecipeViewSet.as_view({'get': 'feed'},
+                               pagination_class=FeedPagination),
+         name='users-feed'),
+    path('api/metrics/', metrics, name='metrics'),
+    # Short links
+    path('s/<str:code>/', short_link_redirect, name='short-link'),
+    # Старые сохранённые ссылки вида /<8 символов> без префикса s/
+    re_path(r'^(?P<code>[A-Za-z0-9]{8})$', short_link_redirect,
+            name='legacy-short-link'),
 ]
\ No newline at end of file
@@ -1,20 +1,33 @@
-from django.db.models import Sum
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+import os
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Value
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404, redirect
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.exceptions import NotFound, ValidationError
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
+from api import bulk
 from api.filters import IngredientFilter, RecipeFilter
+from api.indexes import ingredient_catalog, ingredient_index, tag_catalog
+from core.conditional import changed_at, conditional, last_modified, make_etag
+from core.ordering import StableOrderingFilter
 from core.pagination import CustomPagination
-from api.models import Ingredient, Recipe, Favorite, ShoppingCart, RecipeIngredient
+from core.telemetry import registry
+from api.models import (
+    Ingredient, Recipe, Favorite, ShoppingCart, ShoppingListItem, Tag,
+    resolve_short_code
+)
 from api.permissions import IsAuthorOrReadOnly
+from users.loaders import get_subscription_loader
+from users.models import User
 from api.serializers import (
-    IngredientSerializer, RecipeSerializer,
-    FavoriteSerializer,
+    IngredientSerializer, RecipeSerializer, TagSerializer,
+    FavoriteSerializer, RecipeIdsSerializer,
     ShoppingCartSerializer, RecipeShortLinkSerializer, ShoppingCartRecipeSerializer, FavoriteRecipeSerializer
 )
 
@@ -26,21 +39,143 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_class = IngredientFilter
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            # Автодополнение обслуживается индексом в памяти, без запроса к БД
+            return Response(ingredient_index.search(
+                name, getattr(settings, 'INGREDIENT_SEARCH_LIMIT', None)
+            ))
+        if not request.query_params:
+            # Полный каталог отдаётся готовыми байтами с ETag
+            return ingredient_catalog.response(request)
+        return super().list(request, *args, **kwargs)
+
+
+class TagViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Tag.objects.all()
+    serializer_class = TagSerializer
+    permission_classes = [AllowAny]
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        # Тегов немного, список отдаётся из каталога в памяти
+        return Response(tag_catalog.all())
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
-    filter_backends = [DjangoFilterBackend]
+    filter_backends = [DjangoFilterBackend, StableOrderingFilter]
     filterset_class = RecipeFilter
+    ordering_fields = (
+        'pub_date', 'favorites_count', 'in_carts_count', 'popular_score',
+        'trending_score'
+    )
+    ordering_aliases = {
+        'popular': ('-popular_score',), 'trending': ('-trending_score',)
+    }
     pagination_class = CustomPagination
     permission_classes = [IsAuthorOrReadOnly]
 
     serializer_class = RecipeSerializer
 
+    @property
+    def cursor_ordering(self):
+        # Курсор идёт по той же сортировке, что выбрана в ?ordering=
+        return StableOrderingFilter().get_ordering(
+            self.request, self.queryset, self
+        ) or ('-pub_date', '-id')
+
+    def get_queryset(self):
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            'recipe_ingredients__ingredient'
+        )
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+            )
+        # Флаги текущего пользователя считаются подзапросами в одном SELECT,
+        # а не отдельным exists() на каждый рецепт
+        return queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+        )
+
+    def recipe_version(self, recipe):
+        """Всё, от чего зависит карточка рецепта для текущего пользователя."""
+        author = recipe.author
+        return (
+            recipe.pk, recipe.updated_at, author.updated_at,
+            bool(recipe.is_favorited), bool(recipe.is_in_shopping_cart),
+            get_subscription_loader(self.request).is_subscribed(author.pk),
+            *(getattr(recipe, field) for field in Recipe.COUNTERS),
+            *(getattr(author, field) for field in User.COUNTERS),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        recipe = self.get_object()
+        return conditional(
+            request, make_etag(*self.recipe_version(recipe)),
+            # Счётчики рецепта меняются вместе с engagement_at, а счётчики
+            # автора отмечаются только общей отметкой модели
+            max(
+                last_modified(
+                    recipe.updated_at, recipe.engagement_at,
+                    recipe.author.updated_at
+                ),
+                changed_at(User)
+            ),
+            lambda: Response(self.get_serializer(recipe).data)
+        )
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(
+            self.filter_queryset(self.get_queryset())
+        )
+        get_subscription_loader(request).prime(
+            recipe.author_id for recipe in page
+        )
+        # count и ссылки страницы тоже входят в ETag
+        meta = self.get_paginated_response([]).data
+        meta.pop('results')
+        return conditional(
+            request,
+            make_etag(
+                *meta.items(), *map(self.recipe_version, page)
+            ),
+            max(changed_at(Recipe), changed_at(User)),
+            lambda: self.get_paginated_response(
+                self.get_serializer(page, many=True).data
+            )
+        )
+
+    @action(
+        methods=['get'],
+        detail=False,
+        permission_classes=[IsAuthenticated]
+    )
+    def feed(self, request):
+        # Новые рецепты авторов из подписок; в urls для него подключена
+        # FeedPagination, страницы только по курсору
+        page = self.paginate_queryset(self.get_queryset())
+        get_subscription_loader(request).prime(
+            recipe.author_id for recipe in page
+        )
+        return self.get_paginated_response(
+            self.get_serializer(page, many=True).data
+        )
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
     def get_permissions(self):
-        if self.action == 'create':
+        if self.action in ['create', 'feed']:
             return [IsAuthenticated()]
         elif self.action in ['update', 'partial_update', 'destroy']:
             return [IsAuthorOrReadOnly()]
@@ -92,11 +227,46 @@ class RecipeShortLinkViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class ShoppingCartViewSet(viewsets.ModelViewSet):
+def short_link_redirect(request, code):
+    """GET /s/<code>/ или старая /<code> — переход на страницу рецепта."""
+    try:
+        recipe_id = resolve_short_code(code)
+    except Recipe.DoesNotExist:
+        raise Http404('Рецепт не найден')
+    return redirect(f'/recipes/{recipe_id}')
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    """GET /api/metrics/ — гистограммы запросов по маршрутам этого процесса."""
+    return Response({'pid': os.getpid(), **registry.snapshot()})
+
+
+class BulkRecipesMixin:
+    """Массовое добавление и удаление рецептов списком id.
+
+    Модель связи задаёт атрибут bulk_model; в ответе статус для каждого id.
+    """
+    bulk_model = None
+
+    @action(detail=False, methods=['post', 'delete'])
+    def bulk(self, request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operation = bulk.add if request.method == 'POST' else bulk.remove
+        return Response({'results': operation(
+            self.bulk_model, request.user,
+            serializer.validated_data['recipes']
+        )})
+
+
+class ShoppingCartViewSet(BulkRecipesMixin, viewsets.ModelViewSet):
     queryset = ShoppingCart.objects.all()
     serializer_class = ShoppingCartRecipeSerializer
     permission_classes = [IsAuthenticated]
     http_method_names = ['get', 'post', 'delete']
+    bulk_model = ShoppingCart
 
     def get_queryset(self):
         user = self.request.user
@@ -165,34 +335,41 @@ class ShoppingCartViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def download_shopping_cart(self, request):
-        user = request.user
-
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__in_shopping_cart__user=user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(total_amount=Sum('amount'))
-
-        if not ingredients.exists():
+        items = ShoppingListItem.objects.filter(
+            user=request.user
+        ).select_related('ingredient').order_by('ingredient__name')
+
+        content = [
+            f"{item.ingredient.name} — {item.amount} "
+            f"{item.ingredient.measurement_unit}\n"
+            for item in items
+        ]
+        if not content:
             return Response({'error': 'Корзина пуста'}, status=status.HTTP_400_BAD_REQUEST)
 
-        content = []
-        for item in ingredients:
-            content.append(
-                f"{item['ingredient__name']} — {item['total_amount']} {item['ingredient__measurement_unit']}\n"
-            )
-
         response = HttpResponse(content, content_type='text/plain')
         response['Content-Disposition'] = 'attachment; filename="shopping_list.txt"'
         return response
 
+    @action(detail=False, methods=['post'])
+    def from_favorites(self, request):
+        """Добавляет в корзину все рецепты из избранного."""
+        return Response({'added': bulk.favorites_to_cart(request.user)})
+
+    @action(detail=False, methods=['delete'])
+    def clear(self, request):
+        bulk.clear_cart(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
-class FavoriteViewSet(viewsets.ModelViewSet):
+class FavoriteViewSet(BulkRecipesMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = FavoriteRecipeSerializer
     permission_classes = [IsAuthenticated]
     http_method_names = ['get', 'post', 'delete']
+    bulk_model = Favorite
     pagination_class = CustomPagination  # если используешь пагинацию
+    cursor_ordering = ('-id',)
 
     def get_queryset(self):
         user = self.request.user
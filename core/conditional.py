@@ -0,0 +1,66 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers
+)
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    """Слабый ETag из значений, от которых зависит тело ответа."""
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+
+def last_modified(*moments):
+    """Наибольшая из дат в секундах Unix или None, если дат нет."""
+    moments = [moment for moment in moments if moment is not None]
+    if not moments:
+        return None
+    return int(max(moment.timestamp() for moment in moments))
+
+
+def changed_key(model):
+    return f'conditional:changed:{model._meta.label_lower}'
+
+
+def touch(model):
+    """Запоминает время изменения любых объектов модели (для списков)."""
+    cache.set(changed_key(model), int(time.time()), None)
+
+
+def changed_at(model):
+    # Без отметки в кэше считаем, что изменения были только что: клиент
+    # получит полный ответ, но не устаревший 304
+    return cache.get_or_set(changed_key(model), lambda: int(time.time()), None)
+
+
+def set_validators(request, response, etag, modified=None):
+    response['ETag'] = etag
+    if modified is not None:
+        response['Last-Modified'] = http_date(modified)
+    # Ответ зависит от пользователя: флаги is_favorited, is_subscribed и т. п.
+    patch_vary_headers(response, ('Authorization',))
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+def conditional(request, etag, modified, render):
+    """Ответ 304, если у клиента актуальная версия, иначе render().
+
+    Last-Modified отдаётся только анонимам: у избранного, корзины и
+    подписок нет дат изменения, и для авторизованных их учитывает лишь ETag.
+    """
+    if request.user.is_authenticated:
+        modified = None
+    response = get_conditional_response(
+        request, etag=etag, last_modified=modified
+    )
+    if response is None:
+        response = render()
+    return set_validators(request, response, etag, modified)
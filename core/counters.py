@@ -0,0 +1,58 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from core.conditional import touch
+
+
+def save_without_counters(instance, kwargs):
+    """Исключает счётчики из полного сохранения уже существующего объекта.
+
+    Иначе save() записал бы значения, прочитанные до параллельных F()
+    обновлений, и затёр бы их. Исключаемые поля перечислены в атрибуте
+    модели DERIVED_FIELDS.
+    """
+    if instance._state.adding or kwargs.get('update_fields') is not None:
+        return
+    deferred = instance.get_deferred_fields()
+    kwargs['update_fields'] = [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in instance.DERIVED_FIELDS
+        and field.attname not in deferred
+    ]
+
+
+def shift(model, pk, field, delta, **values):
+    """Атомарно меняет счётчик на delta одним UPDATE с F().
+
+    Счётчик не уходит ниже нуля, даже если разошёлся с данными до сверки.
+    В values можно передать другие поля для того же UPDATE. UPDATE не
+    меняет updated_at, поэтому изменение отмечается через touch() для
+    Last-Modified.
+    """
+    queryset = model._default_manager.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    if queryset.update(**{field: F(field) + delta}, **values):
+        touch(model)
+
+
+def actual_count(related_model, related_field):
+    """Подзапрос с фактическим числом связанных строк для OuterRef('pk')."""
+    return Coalesce(Subquery(
+        related_model._default_manager.filter(
+            **{related_field: OuterRef('pk')}
+        ).order_by().values(related_field).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)
+
+
+def reconcile(model, field, related_model, related_field):
+    """Исправляет разошедшиеся значения счётчика; возвращает их число."""
+    actual = actual_count(related_model, related_field)
+    fixed = model._default_manager.exclude(**{field: actual}).update(
+        **{field: actual}
+    )
+    if fixed:
+        touch(model)
+    return fixed
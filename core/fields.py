@@ -0,0 +1,121 @@
+import binascii
+import json
+import os
+import tempfile
+import uuid
+import weakref
+from contextlib import suppress
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.images import get_image_dimensions
+from django.core.files.uploadedfile import UploadedFile
+from rest_framework import serializers
+
+
+def remove_file(path):
+    with suppress(FileNotFoundError):
+        os.remove(path)
+
+
+class DecodedTemporaryFile(UploadedFile):
+    """Декодированное изображение во временном файле на диске.
+
+    Хранилище переносит файл на место вместо копирования, а если файл так
+    и не был сохранён, он удаляется вместе с объектом.
+    """
+
+    def __init__(self, name, content_type):
+        descriptor, self.path = tempfile.mkstemp(
+            suffix='.upload', dir=settings.FILE_UPLOAD_TEMP_DIR
+        )
+        super().__init__(
+            os.fdopen(descriptor, 'w+b'), name, content_type, 0, None
+        )
+        weakref.finalize(self, remove_file, self.path)
+
+    def temporary_file_path(self):
+        return self.path
+
+
+class Base64ImageField(serializers.ImageField):
+    """Изображение в виде data URL с base64 или обычного файла из multipart.
+
+    base64 декодируется частями прямо во временный файл, размер
+    проверяется до декодирования, а число пикселей — по заголовку
+    изображения, так что большие загрузки не копируются целиком в память.
+    """
+    default_error_messages = {
+        'invalid_base64': 'Некорректные данные изображения в base64.',
+        'too_large': 'Размер изображения не должен превышать {max_size} байт.',
+        'too_many_pixels': (
+            'Изображение не должно содержать больше {max_pixels} пикселей.'
+        ),
+    }
+    # Кратно 4, чтобы каждая часть декодировалась независимо
+    chunk_size = 64 * 1024
+
+    def to_internal_value(self, data):
+        max_size = settings.IMAGE_UPLOAD_MAX_BYTES
+        if isinstance(data, str) and data.startswith('data:image'):
+            data = self.decode_base64(data, max_size)
+        elif getattr(data, 'size', 0) > max_size:
+            self.fail('too_large', max_size=max_size)
+        if not isinstance(data, (ContentFile, UploadedFile)):
+            # Строку вроде пути на сервере отклоняет проверка файла в DRF;
+            # get_image_dimensions открыл бы её как файл
+            return super().to_internal_value(data)
+        self.check_pixels(data)
+        return super().to_internal_value(data)
+
+    def decode_base64(self, data, max_size):
+        header, separator, payload = data.partition(';base64,')
+        if not separator:
+            self.fail('invalid_base64')
+        payload = payload.strip()
+        decoded_size = len(payload) * 3 // 4 - payload[-2:].count('=')
+        if decoded_size > max_size:
+            self.fail('too_large', max_size=max_size)
+
+        ext = header.split('/')[-1]
+        name = f'{uuid.uuid4()}.{ext}'
+        if decoded_size <= settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            try:
+                return ContentFile(binascii.a2b_base64(payload), name=name)
+            except binascii.Error:
+                self.fail('invalid_base64')
+
+        upload = DecodedTemporaryFile(name, header.partition(':')[2])
+        try:
+            for start in range(0, len(payload), self.chunk_size):
+                upload.write(binascii.a2b_base64(
+                    payload[start:start + self.chunk_size]
+                ))
+        except binascii.Error:
+            upload.close()
+            self.fail('invalid_base64')
+        upload.size = upload.tell()
+        upload.seek(0)
+        return upload
+
+    def check_pixels(self, data):
+        width, height = get_image_dimensions(data)
+        max_pixels = settings.IMAGE_UPLOAD_MAX_PIXELS
+        if width and height and width * height > max_pixels:
+            self.fail('too_many_pixels', max_pixels=max_pixels)
+
+
+class JSONListField(serializers.ListField):
+    """Список, который в multipart-запросе можно передать строкой JSON."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, list) and len(data) == 1 and isinstance(
+            data[0], str
+        ):
+            data = data[0]
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except ValueError:
+                self.fail('not_a_list', input_type='str')
+        return super().to_internal_value(data)
@@ -0,0 +1,170 @@
+import base64
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from core.conditional import touch
+
+logger = logging.getLogger(__name__)
+
+# Ширина вариантов в пикселях; меньшие изображения не увеличиваются
+VARIANT_WIDTHS = {'thumbnail': 160, 'card': 480, 'full': 1200}
+VARIANT_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+VARIANT_QUALITY = 80
+PLACEHOLDER_WIDTH = 16
+
+_executor = None
+
+
+def render_variants(source_path, media_root, name):
+    """Создаёт варианты изображения и крошечную заглушку.
+
+    Выполняется в отдельном процессе, поэтому работает только с файлами и
+    не обращается к Django ORM. Возвращает описание для поля *_variants.
+    """
+    from PIL import Image, ImageOps
+
+    stem = os.path.splitext(os.path.basename(name))[0]
+    directory = os.path.join(os.path.dirname(name), 'variants', stem)
+    os.makedirs(os.path.join(media_root, directory), exist_ok=True)
+
+    with Image.open(source_path) as source:
+        image = ImageOps.exif_transpose(source).convert('RGB')
+
+    files = {}
+    for size, width in VARIANT_WIDTHS.items():
+        resized = image
+        if image.width > width:
+            resized = image.resize(
+                (width, max(1, round(image.height * width / image.width))),
+                Image.LANCZOS
+            )
+        files[size] = {}
+        for extension, image_format in VARIANT_FORMATS.items():
+            variant_name = f'{directory}/{size}.{extension}'
+            resized.save(
+                os.path.join(media_root, variant_name), image_format,
+                quality=VARIANT_QUALITY
+            )
+            files[size][extension] = variant_name
+
+    tiny = image.copy()
+    tiny.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH))
+    buffer = BytesIO()
+    tiny.save(buffer, 'JPEG', quality=50)
+    placeholder = 'data:image/jpeg;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+    return {'source': name, 'files': files, 'placeholder': placeholder}
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # spawn: дочерние процессы не наследуют соединения с БД и потоки
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_VARIANT_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _executor
+
+
+def update_variants(queryset, variants_field, value):
+    """Сохраняет варианты и отмечает изменение объекта для условных GET."""
+    values = {variants_field: value}
+    try:
+        queryset.model._meta.get_field('updated_at')
+        values['updated_at'] = timezone.now()
+    except FieldDoesNotExist:
+        pass
+    if queryset.update(**values):
+        touch(queryset.model)
+
+
+def store_variants(model, pk, field_name, variants_field, result):
+    # Обновляем, только если изображение не сменилось, пока шла обработка
+    update_variants(
+        model._default_manager.filter(pk=pk, **{field_name: result['source']}),
+        variants_field, result
+    )
+
+
+def _store_from_future(model, pk, field_name, variants_field, future):
+    close_old_connections()
+    try:
+        store_variants(model, pk, field_name, variants_field, future.result())
+    except Exception:
+        logger.exception('Не удалось создать варианты %s', field_name)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(instance, field_name, variants_field):
+    """Ставит создание вариантов в очередь после фиксации транзакции.
+
+    При IMAGE_VARIANT_WORKERS = 0 варианты создаются сразу в текущем
+    процессе, что удобно для тестов и разработки.
+    """
+    file = getattr(instance, field_name)
+    if not file:
+        if getattr(instance, variants_field):
+            update_variants(
+                type(instance)._default_manager.filter(pk=instance.pk),
+                variants_field, {}
+            )
+        return
+    if getattr(instance, variants_field).get('source') == file.name:
+        return
+
+    model, pk, name = type(instance), instance.pk, file.name
+    arguments = (default_storage.path(name), settings.MEDIA_ROOT, name)
+
+    def submit():
+        if not settings.IMAGE_VARIANT_WORKERS:
+            store_variants(
+                model, pk, field_name, variants_field,
+                render_variants(*arguments)
+            )
+            return
+        future = get_executor().submit(render_variants, *arguments)
+        future.add_done_callback(
+            partial(_store_from_future, model, pk, field_name, variants_field)
+        )
+
+    transaction.on_commit(submit)
+
+
+def variant_urls(request, file, variants):
+    """Ссылки на варианты изображения для ответа API.
+
+    Пока варианты не готовы, все размеры указывают на оригинал, а
+    заглушка отсутствует.
+    """
+    if not file:
+        return None
+
+    def absolute(url):
+        return request.build_absolute_uri(url) if request else url
+
+    original = absolute(file.url)
+    ready = variants.get('source') == file.name
+    result = {
+        size: {
+            extension: absolute(default_storage.url(
+                variants['files'][size][extension]
+            )) if ready else original
+            for extension in VARIANT_FORMATS
+        }
+        for size in VARIANT_WIDTHS
+    }
+    result['placeholder'] = variants.get('placeholder') if ready else None
+    return result
@@ -0,0 +1,99 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from core.routers import use_replicas
+from core.telemetry import (
+    QueryBudgetExceeded, RequestMetrics, current_metrics, registry
+)
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'pin_primary'
+
+
+class ReplicaRoutingMiddleware:
+    """Разрешает чтение с реплик для безопасных запросов.
+
+    После изменяющего запроса клиент получает короткую cookie, и его
+    запросы на время REPLICA_PIN_SECONDS читают из основной базы, чтобы
+    не увидеть устаревшие данные из-за задержки репликации.
+    """
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        safe = request.method in self.safe_methods
+        token = use_replicas.set(
+            safe and PIN_COOKIE not in request.COOKIES
+        )
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replicas.reset(token)
+        if not safe and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax'
+            )
+        return response
+
+
+def query_budget(route, method):
+    """Допустимое число SQL-запросов для маршрута или None.
+
+    Бюджет задаётся числом для всех методов или словарём по методам.
+    """
+    budget = settings.QUERY_BUDGETS.get(route)
+    if isinstance(budget, dict):
+        return budget.get(method)
+    return budget
+
+
+class ServerTimingMiddleware:
+    """Измеряет SQL, сериализацию и время обработки каждого запроса.
+
+    Значения передаются клиенту в заголовке Server-Timing и копятся в
+    гистограммах по имени маршрута. Превышение бюджета SQL-запросов
+    записывается в лог или, при QUERY_BUDGET_MODE = 'raise', прерывает
+    запрос исключением.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(metrics.execute_wrapper)
+                    )
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        metrics.view_time = time.perf_counter() - started
+        response['Server-Timing'] = metrics.server_timing()
+
+        match = request.resolver_match
+        route = match.url_name if match and match.url_name else 'unresolved'
+        budget = query_budget(route, request.method)
+        over_budget = budget is not None and metrics.queries > budget
+        registry.record(route, metrics, over_budget)
+        if over_budget:
+            message = (
+                f'{request.method} {route}: {metrics.queries} SQL-запросов '
+                f'при бюджете {budget}'
+            )
+            if settings.QUERY_BUDGET_MODE == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,25 @@
+from rest_framework.filters import OrderingFilter
+
+
+class StableOrderingFilter(OrderingFilter):
+    """Сортировка по ?ordering= с первичным ключом в конце.
+
+    У счётчиков много одинаковых значений, и без дополнительного ключа
+    записи перемешивались бы между страницами. Атрибут view
+    ordering_aliases задаёт короткие имена, например popular.
+    """
+
+    def remove_invalid_fields(self, queryset, fields, view, request):
+        aliases = getattr(view, 'ordering_aliases', {})
+        fields = [
+            field for term in fields for field in aliases.get(term, (term,))
+        ]
+        return super().remove_invalid_fields(queryset, fields, view, request)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering or any(
+            field.lstrip('-') in ('pk', 'id') for field in ordering
+        ):
+            return ordering
+        return [*ordering, '-pk' if ordering[0].startswith('-') else 'pk']
@@ -1,17 +1,252 @@
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
-from collections import OrderedDict
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from core.routers import primary_reads
+
+
+COUNT_VERSION_KEY = 'pagination:count-version'
+
+
+def invalidate_counts():
+    """Сбрасывает все закэшированные count, меняя версию ключей."""
+    try:
+        cache.incr(COUNT_VERSION_KEY)
+    except ValueError:
+        cache.set(COUNT_VERSION_KEY, 2, None)
+
+
+def estimate_count(model, using='default'):
+    """Быстрая оценка числа строк в таблице без COUNT(*)."""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return row[0]
+    # Для остальных СУБД наибольший id берётся по индексу первичного ключа
+    # и близок к числу строк, пока записи удаляются редко
+    return model._default_manager.using(using).aggregate(
+        total=Max('pk')
+    )['total'] or 0
+
+
+class CountedPaginator(Paginator):
+    """Paginator, получающий count через переданную стратегию подсчёта."""
+
+    def __init__(self, object_list, per_page, counter, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.counter = counter
+
+    @cached_property
+    def count(self):
+        return self.counter(self.object_list)
 
 
 class CustomPagination(PageNumberPagination):
+    """Постраничная пагинация с необязательным режимом курсора.
+
+    Если в запросе есть параметр ``cursor`` (в том числе пустой), страница
+    выбирается по ключу сортировки последней записи, а не через OFFSET,
+    поэтому время ответа не зависит от глубины страницы. Поля ключа задаёт
+    атрибут ``cursor_ordering`` у view, по умолчанию ``('id',)``. С
+    ``cursor_only = True`` режим курсора включён всегда.
+    """
     page_size_query_param = 'limit'
     page_size = 6
     max_page_size = 100
+    cursor_query_param = 'cursor'
+    cursor_ordering = ('id',)
+    cursor_only = False
+    invalid_cursor_message = 'Неверный курсор'
+
+    def django_paginator_class(self, object_list, per_page):
+        return CountedPaginator(object_list, per_page, self.get_count)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.count_exact = True
+        self.cursor_mode = (
+            self.cursor_only or self.cursor_query_param in request.query_params
+        )
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.ordering = tuple(
+            getattr(view, 'cursor_ordering', None) or self.cursor_ordering
+        )
+        size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request, queryset.model)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self.invert(field) for field in ordering)
+        # Берём на одну запись больше, чтобы узнать, есть ли следующая
+        results = self.fetch(queryset, ordering, values, size + 1)
+        has_more = len(results) > size
+        results = results[:size]
+        if reverse:
+            results.reverse()
+
+        self.next_values = self.previous_values = None
+        if results:
+            first, last = results[0], results[-1]
+            if reverse:
+                self.next_values = self.key_of(last)
+                if has_more:
+                    self.previous_values = self.key_of(first)
+            else:
+                if has_more:
+                    self.next_values = self.key_of(last)
+                if values is not None:
+                    self.previous_values = self.key_of(first)
+        return results
 
     def get_paginated_response(self, data):
+        if getattr(self, 'cursor_mode', False):
+            return Response(OrderedDict([
+                ('count', None),
+                ('count_exact', False),
+                ('next', self.get_cursor_link(self.next_values, False)),
+                ('previous', self.get_cursor_link(self.previous_values, True)),
+                ('results', data)
+            ]))
         return Response(OrderedDict([
             ('count', self.page.paginator.count),
+            ('count_exact', self.count_exact),
             ('next', self.get_next_link()),
             ('previous', self.get_previous_link()),
             ('results', data)
-        ]))
\ No newline at end of file
+        ]))
+
+    def get_filter_params(self):
+        ignored = {
+            self.page_query_param, self.page_size_query_param,
+            self.cursor_query_param
+        }
+        return sorted(
+            (key, value)
+            for key, values in self.request.query_params.lists()
+            if key not in ignored
+            for value in values
+        )
+
+    def get_count(self, queryset):
+        params = self.get_filter_params()
+        user = self.request.user
+        query = getattr(queryset, 'query', None)
+        unfiltered = not params and query is not None and not query.where
+        if not user.is_authenticated and unfiltered:
+            estimate = estimate_count(queryset.model, queryset.db)
+            if estimate >= getattr(
+                settings, 'PAGINATION_ESTIMATE_THRESHOLD', 10000
+            ):
+                self.count_exact = False
+                return estimate
+
+        version = cache.get_or_set(COUNT_VERSION_KEY, 1, None)
+        # Путь и параметры хэшируются: в ключах memcached нельзя пробелы
+        digest = hashlib.md5(json.dumps(
+            [self.request.path, params], ensure_ascii=False
+        ).encode()).hexdigest()
+        key = 'pagination:count:{}:{}:{}'.format(
+            version, user.pk if user.is_authenticated else 'anon', digest
+        )
+        count = cache.get(key)
+        if count is None:
+            # count хранится в общем кэше, поэтому считается по основной базе
+            with primary_reads():
+                count = Paginator(queryset, self.page_size).count
+            cache.set(key, count, getattr(
+                settings, 'PAGINATION_COUNT_CACHE_TIMEOUT', 300
+            ))
+        return count
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def fetch(self, queryset, ordering, values, limit):
+        """Первые limit записей после ключа values в порядке ordering."""
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self.seek_filter(ordering, values))
+        return list(queryset[:limit])
+
+    @staticmethod
+    def seek_filter(ordering, values):
+        """Условие «строго после values» для составного ключа сортировки."""
+        condition = Q()
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            step = Q(**{f'{name}__{lookup}': values[index]})
+            for previous, value in zip(ordering[:index], values):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def key_of(self, obj):
+        key = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip('-'))
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            key.append(value)
+        return key
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            padding = '=' * (-len(encoded) % 4)
+            payload = json.loads(
+                base64.urlsafe_b64decode(encoded + padding).decode()
+            )
+            values, reverse = payload['v'], bool(payload.get('r'))
+        except (AttributeError, TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        # Значения из курсора приводятся к типам полей: иначе подделанный
+        # курсор дошёл бы до фильтра и вызвал ошибку сервера
+        try:
+            values = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (ValidationError, ValueError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in values:
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def get_cursor_link(self, values, reverse):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        if values is None:
+            return None
+        payload = json.dumps({'v': values, 'r': int(reverse)})
+        encoded = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(
+            url, self.cursor_query_param, encoded.rstrip('=')
+        )
@@ -0,0 +1,48 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Читать с реплик можно только внутри безопасного запроса
+use_replicas = ContextVar('use_replicas', default=False)
+
+
+@contextmanager
+def primary_reads():
+    """Чтения внутри блока идут в основную базу и в безопасном запросе.
+
+    Нужен для данных, которые кэшируются для всех запросов: отставшая
+    реплика сохранила бы старые строки под новой версией.
+    """
+    token = use_replicas.set(False)
+    try:
+        yield
+    finally:
+        use_replicas.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """Направляет чтение на реплики, а запись — на основную базу.
+
+    Реплики используются только для GET/HEAD/OPTIONS-запросов, которые
+    отмечает ReplicaRoutingMiddleware. Первая запись в запросе
+    закрепляет все последующие чтения за основной базой.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if replicas and use_replicas.get():
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        use_replicas.set(False)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
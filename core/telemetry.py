@@ -0,0 +1,159 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Границы корзин гистограмм: время в миллисекундах и число SQL-запросов
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34)
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    """Запрос выполнил больше SQL-запросов, чем разрешено для маршрута."""
+
+
+class RequestMetrics:
+    """Показатели одного HTTP-запроса."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serialize_time = 0.0
+        self.view_time = 0.0
+        self._serializing = False
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql_time += time.perf_counter() - started
+
+    def server_timing(self):
+        return ', '.join((
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries"',
+            f'serialize;dur={self.serialize_time * 1000:.1f}',
+            f'view;dur={self.view_time * 1000:.1f}',
+        ))
+
+
+@contextmanager
+def measure_serialization():
+    """Добавляет время блока к сериализации текущего запроса.
+
+    Вложенные сериализаторы не учитываются повторно.
+    """
+    metrics = current_metrics.get()
+    if metrics is None or metrics._serializing:
+        yield
+        return
+    metrics._serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialize_time += time.perf_counter() - started
+        metrics._serializing = False
+
+
+class TimedSerializerMixin:
+    """Учитывает построение serializer.data в метриках запроса."""
+
+    @property
+    def data(self):
+        with measure_serialization():
+            return super().data
+
+
+class RouteStats:
+
+    def __init__(self):
+        self.requests = 0
+        self.over_budget = 0
+        self.max_queries = 0
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serialize_time = 0.0
+        self.view_time = 0.0
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.query_counts = [0] * (len(QUERY_BUCKETS) + 1)
+
+    def add(self, metrics, over_budget):
+        self.requests += 1
+        self.over_budget += over_budget
+        self.queries += metrics.queries
+        self.max_queries = max(self.max_queries, metrics.queries)
+        self.sql_time += metrics.sql_time
+        self.serialize_time += metrics.serialize_time
+        self.view_time += metrics.view_time
+        self.latency[
+            bisect_left(LATENCY_BUCKETS, metrics.view_time * 1000)
+        ] += 1
+        self.query_counts[bisect_left(QUERY_BUCKETS, metrics.queries)] += 1
+
+    def as_dict(self):
+        requests = self.requests or 1
+        return {
+            'requests': self.requests,
+            'over_budget': self.over_budget,
+            'queries_avg': self.queries / requests,
+            'queries_max': self.max_queries,
+            'sql_ms_avg': self.sql_time * 1000 / requests,
+            'serialize_ms_avg': self.serialize_time * 1000 / requests,
+            'view_ms_avg': self.view_time * 1000 / requests,
+            'latency_ms': histogram(LATENCY_BUCKETS, self.latency),
+            'queries': histogram(QUERY_BUCKETS, self.query_counts),
+        }
+
+
+def histogram(bounds, counts):
+    """Накопительная гистограмма в духе Prometheus: le → число запросов."""
+    result, total = {}, 0
+    for bound, count in zip((*bounds, '+Inf'), counts):
+        total += count
+        result[str(bound)] = total
+    return result
+
+
+class MetricsRegistry:
+    """Метрики маршрутов и счётчики в памяти процесса.
+
+    Каждый процесс gunicorn собирает свои значения, поэтому в ответе
+    указывается pid.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._routes = {}
+            self._counters = {}
+
+    def record(self, route, metrics, over_budget=False):
+        with self._lock:
+            self._routes.setdefault(route, RouteStats()).add(
+                metrics, over_budget
+            )
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'routes': {
+                    route: stats.as_dict()
+                    for route, stats in sorted(self._routes.items())
+                },
+                'counters': dict(self._counters),
+            }
+
+
+registry = MetricsRegistry()
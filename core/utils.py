@@ -0,0 +1,43 @@
+import string
+from math import gcd
+
+BASE62_ALPHABET = string.digits + string.ascii_letters
+SHORT_CODE_LENGTH = 6
+SHORT_CODE_SPACE = len(BASE62_ALPHABET) ** SHORT_CODE_LENGTH
+# Взаимно простой с SHORT_CODE_SPACE множитель делает отображение
+# id -> код перестановкой, соседние id получают непохожие коды
+SHORT_CODE_MULTIPLIER = 40_692_737_753
+SHORT_CODE_OFFSET = 17_211_987_473
+
+assert gcd(SHORT_CODE_MULTIPLIER, SHORT_CODE_SPACE) == 1
+
+
+def encode_short_code(number):
+    """Короткий код фиксированной длины для положительного id."""
+    if not 0 < number < SHORT_CODE_SPACE:
+        raise ValueError('id вне диапазона коротких кодов')
+    value = (
+        number * SHORT_CODE_MULTIPLIER + SHORT_CODE_OFFSET
+    ) % SHORT_CODE_SPACE
+    chars = []
+    for _ in range(SHORT_CODE_LENGTH):
+        value, index = divmod(value, len(BASE62_ALPHABET))
+        chars.append(BASE62_ALPHABET[index])
+    return ''.join(reversed(chars))
+
+
+def decode_short_code(code):
+    """Обратное к encode_short_code; None, если код некорректен."""
+    if len(code) != SHORT_CODE_LENGTH:
+        return None
+    value = 0
+    for char in code:
+        index = BASE62_ALPHABET.find(char)
+        if index < 0:
+            return None
+        value = value * len(BASE62_ALPHABET) + index
+    number = (
+        (value - SHORT_CODE_OFFSET)
+        * pow(SHORT_CODE_MULTIPLIER, -1, SHORT_CODE_SPACE)
+    ) % SHORT_CODE_SPACE
+    return number or None
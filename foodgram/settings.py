@@ -64,6 +64,8 @@ REST_FRAMEWORK = {
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'core.middleware.ServerTimingMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -117,6 +119,66 @@ DATABASES = {
     }
 }
 
+# Реплики только для чтения: пути к копиям SQLite через запятую в
+# DB_REPLICAS. Для других СУБД реплики добавляются в DATABASES под
+# именами replica_N. Копии обновляет manage.py sync_replicas.
+for index, name in enumerate(
+    filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1
+):
+    DATABASES[f'replica_{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_REPLICAS = [
+    alias for alias in DATABASES if alias.startswith('replica_')
+]
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+# Сколько секунд после записи клиент читает из основной базы
+REPLICA_PIN_SECONDS = 5
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Кэш count в пагинации и порог, с которого анонимные списки без фильтров
+# получают оценку числа записей вместо COUNT(*)
+PAGINATION_COUNT_CACHE_TIMEOUT = 60 * 5
+PAGINATION_ESTIMATE_THRESHOLD = 10000
+# Сколько хранятся общие для всех пользователей фрагменты карточек рецептов
+RECIPE_FRAGMENT_CACHE_TIMEOUT = 60 * 60
+# Рецепты авторов, у которых рецептов больше порога, не раскладываются по
+# входящим подписчиков, а подмешиваются в ленту при чтении
+FEED_FANOUT_MAX_RECIPES = 500
+
+# Ограничения на загружаемые изображения рецептов и аватаров
+IMAGE_UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+IMAGE_UPLOAD_MAX_PIXELS = 25_000_000
+# Процессы для нарезки вариантов изображений; 0 — нарезать сразу в запросе
+IMAGE_VARIANT_WORKERS = 2
+
+# Сколько подсказок возвращает автодополнение ингредиентов по ?name=
+INGREDIENT_SEARCH_LIMIT = 50
+
+# Допустимое число SQL-запросов на запрос по имени маршрута: число для всех
+# методов или словарь по методам. При превышении ServerTimingMiddleware
+# пишет предупреждение в лог, а в режиме 'raise' — выбрасывает исключение
+QUERY_BUDGETS = {
+    'recipes-list': {'GET': 7},
+    'recipes-detail': {'GET': 6},
+    'subscriptions': {'GET': 6},
+    'users-feed': {'GET': 8},
+    'users-list': {'GET': 5},
+    'users-detail': {'GET': 4},
+    'users-me': {'GET': 3},
+    'ingredients-list': {'GET': 2},
+    'get-shopping-cart': 3,
+}
+QUERY_BUDGET_MODE = os.getenv('QUERY_BUDGET_MODE', 'log')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -10,7 +10,7 @@ User = get_user_model()
 class CustomUserAdmin(UserAdmin):
     list_display = (
         'id', 'username', 'email', 'first_name', 'last_name',
-        'is_staff', 'date_joined'
+        'recipes_count', 'subscribers_count', 'is_staff', 'date_joined'
     )
     list_filter = ('is_staff', 'is_superuser', 'is_active')
     search_fields = ('username', 'email', 'first_name', 'last_name')
@@ -0,0 +1,76 @@
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from users.models import Subscription
+
+
+class SubscriptionLoader:
+    """Подписки текущего пользователя, загружаемые один раз за запрос.
+
+    Хранит для каждого уже проверенного автора признак подписки, поэтому
+    страница из N пользователей или рецептов стоит одного запроса к
+    Subscription вместо N.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._known = {}
+
+    def prime(self, author_ids):
+        """Загружает признаки подписки для ещё не проверенных авторов."""
+        if not self.user.is_authenticated:
+            return
+        missing = {pk for pk in author_ids if pk not in self._known}
+        if not missing:
+            return
+        subscribed = set(Subscription.objects.filter(
+            user=self.user, author_id__in=missing
+        ).values_list('author_id', flat=True))
+        for pk in missing:
+            self._known[pk] = pk in subscribed
+
+    def is_subscribed(self, author_id):
+        if not self.user.is_authenticated:
+            return False
+        if author_id not in self._known:
+            self.prime([author_id])
+        return self._known[author_id]
+
+    def set(self, author_id, value):
+        """Обновляет кэш после подписки или отписки в этом же запросе."""
+        self._known[author_id] = value
+
+
+def get_subscription_loader(request):
+    """Возвращает загрузчик подписок, общий для всех сериализаторов запроса."""
+    # Request из DRF оборачивает HttpRequest, храним загрузчик на исходном
+    # объекте, чтобы его видели все обёртки одного запроса
+    http_request = getattr(request, '_request', request)
+    loader = getattr(http_request, '_subscription_loader', None)
+    if loader is None:
+        loader = SubscriptionLoader(request.user)
+        http_request._subscription_loader = loader
+    return loader
+
+
+def load_recipe_previews(author_ids, limit=None):
+    """Новейшие рецепты каждого автора одним запросом.
+
+    Возвращает словарь author_id -> список рецептов. При заданном limit
+    рецепты нумеруются оконной функцией ROW_NUMBER() в разрезе автора.
+    """
+    from api.models import Recipe
+
+    recipes = Recipe.objects.filter(author_id__in=author_ids).only(
+        'id', 'name', 'image', 'image_variants', 'cooking_time', 'author_id'
+    ).order_by('author_id', '-pub_date', '-id')
+    if limit is not None:
+        recipes = recipes.annotate(row_number=Window(
+            RowNumber(),
+            partition_by=F('author_id'),
+            order_by=(F('pub_date').desc(), F('id').desc()),
+        )).filter(row_number__lte=limit)
+    previews = {author_id: [] for author_id in author_ids}
+    for recipe in recipes:
+        previews[recipe.author_id].append(recipe)
+    return previews
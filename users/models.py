@@ -2,6 +2,8 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.core.validators import RegexValidator
 
+from core.counters import save_without_counters
+
 
 class User(AbstractUser):
     email = models.EmailField(
@@ -34,9 +36,26 @@ class User(AbstractUser):
         blank=True,
         null=True,
     )
+    avatar_variants = models.JSONField(
+        'Варианты аватара',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+    # Счётчики меняются сигналами через F() и сверяются командой
+    # reconcile_counters
+    recipes_count = models.PositiveIntegerField(
+        'Рецептов', default=0, editable=False
+    )
+    subscribers_count = models.PositiveIntegerField(
+        'Подписчиков', default=0, editable=False
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
+    COUNTERS = ('recipes_count', 'subscribers_count')
+    DERIVED_FIELDS = COUNTERS
 
     class Meta:
         ordering = ['id']
@@ -46,6 +65,10 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+    def save(self, *args, **kwargs):
+        save_without_counters(self, kwargs)
+        super().save(*args, **kwargs)
+
 
 class Subscription(models.Model):
     user = models.ForeignKey(
@@ -2,18 +2,35 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
 from rest_framework.authtoken.models import Token
+from users.loaders import get_subscription_loader
 from users.models import Subscription
-import base64
-import uuid
-from django.core.files.base import ContentFile
+from core.fields import Base64ImageField
+from core.images import variant_urls
+from core.telemetry import TimedSerializerMixin
 
 
 User = get_user_model()
 
 
-class CustomUserSerializer(serializers.ModelSerializer):
+class SubscribedListSerializer(
+    TimedSerializerMixin, serializers.ListSerializer
+):
+    """Заранее загружает подписки на всех пользователей страницы."""
+
+    def to_representation(self, data):
+        request = self.context.get('request')
+        if request is not None:
+            items = data.all() if hasattr(data, 'all') else data
+            get_subscription_loader(request).prime(
+                user.id for user in items
+            )
+        return super().to_representation(data)
+
+
+class CustomUserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
     avatar = serializers.ImageField(required=False, allow_null=True)
+    avatar_variants = serializers.SerializerMethodField()
 
     password = serializers.CharField(
         write_only=True,
@@ -29,9 +46,11 @@ class CustomUserSerializer(serializers.ModelSerializer):
         model = User
         fields = (
             'id', 'username', 'first_name', 'last_name',
-            'email', 'password', 'is_subscribed', 'avatar'
+            'email', 'password', 'is_subscribed', 'avatar',
+            'avatar_variants', 'recipes_count', 'subscribers_count'
         )
         read_only_fields = ('is_subscribed',)
+        list_serializer_class = SubscribedListSerializer
 
     def validate(self, data):
         request = self.context.get('request')
@@ -44,11 +63,14 @@ class CustomUserSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return Subscription.objects.filter(
-                user=request.user, author=obj
-            ).exists()
-        return False
+        if request is None:
+            return False
+        return get_subscription_loader(request).is_subscribed(obj.id)
+
+    def get_avatar_variants(self, obj):
+        return variant_urls(
+            self.context.get('request'), obj.avatar, obj.avatar_variants
+        )
 
     def get_auth_token(self, obj):
         request = self.context.get('request')
@@ -80,17 +102,7 @@ class SetPasswordSerializer(serializers.Serializer):
     new_password = serializers.CharField(required=True)
 
 
-class Base64ImageField(serializers.ImageField):
-    def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            id = uuid.uuid4()
-            data = ContentFile(base64.b64decode(imgstr), name=f'{id}.{ext}')
-        return super().to_internal_value(data)
-
-
-class AvatarSerializer(serializers.ModelSerializer):
+class AvatarSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     avatar = Base64ImageField(required=True)
 
     class Meta:
@@ -98,13 +110,39 @@ class AvatarSerializer(serializers.ModelSerializer):
         fields = ('avatar',)
 
 
-class TokenSerializer(serializers.ModelSerializer):
+class TokenSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Token
         fields = ('key', 'user')
 
 
-class SubscriptionSerializer(serializers.Serializer):
+def parse_recipes_limit(request):
+    """Значение recipes_limit из запроса или None, если он не передан."""
+    recipes_limit = request.query_params.get('recipes_limit')
+    if not recipes_limit:
+        return None
+    try:
+        return int(recipes_limit)
+    except ValueError:
+        raise serializers.ValidationError("recipes_limit должен быть числом")
+
+
+class SubscriptionListSerializer(
+    TimedSerializerMixin, serializers.ListSerializer
+):
+    """Заранее загружает подписки на всех авторов страницы подписок."""
+
+    def to_representation(self, data):
+        request = self.context.get('request')
+        if request is not None:
+            items = data.all() if hasattr(data, 'all') else data
+            get_subscription_loader(request).prime(
+                subscription.author_id for subscription in items
+            )
+        return super().to_representation(data)
+
+
+class SubscriptionSerializer(TimedSerializerMixin, serializers.Serializer):
     id = serializers.IntegerField(source='author.id')
     username = serializers.CharField(source='author.username')
     first_name = serializers.CharField(source='author.first_name')
@@ -119,6 +157,7 @@ class SubscriptionSerializer(serializers.Serializer):
             'id', 'username', 'first_name', 'last_name', 'email',
             'is_subscribed', 'avatar', 'recipes_count', 'recipes'
         ]
+        list_serializer_class = SubscriptionListSerializer
 
     def get_is_subscribed(self, obj):
         return True  # Потому что мы уже подписаны
@@ -131,38 +170,47 @@ class SubscriptionSerializer(serializers.Serializer):
 
     def get_author(self, obj):
         user = obj.author
+        request = self.context['request']
         return {
             'id': user.id,
             'username': user.username,
             'first_name': user.first_name,
             'last_name': user.last_name,
             'email': user.email,
-            'is_subscribed': Subscription.objects.filter(
-                user=obj.user, author=user
-            ).exists(),
-            'avatar': self.context['request'].build_absolute_uri(user.avatar.url) if user.avatar else None,
+            'is_subscribed': get_subscription_loader(
+                request
+            ).is_subscribed(user.id),
+            'avatar': (
+                request.build_absolute_uri(user.avatar.url)
+                if user.avatar else None
+            ),
+            'avatar_variants': variant_urls(
+                request, user.avatar, user.avatar_variants
+            ),
         }
 
     def get_recipes_count(self, obj):
-        return obj.author.recipes.count()
+        return obj.author.recipes_count
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-
-        recipes = obj.author.recipes.all()
-
-        if recipes_limit:
-            try:
-                recipes = recipes[:int(recipes_limit)]
-            except ValueError:
-                raise serializers.ValidationError("recipes_limit должен быть числом")
+        previews = self.context.get('recipe_previews')
+        if previews is not None:
+            recipes = previews.get(obj.author_id, [])
+        else:
+            recipes = obj.author.recipes.all()
+            recipes_limit = parse_recipes_limit(request)
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
 
         return [
             {
                 'id': r.id,
                 'name': r.name,
                 'image': request.build_absolute_uri(r.image.url) if r.image else None,
+                'image_variants': variant_urls(
+                    request, r.image, r.image_variants
+                ),
                 'cooking_time': r.cooking_time
             }
             for r in recipes
@@ -181,6 +229,7 @@ class SubscriptionSerializer(serializers.Serializer):
             'email': author_data['email'],
             'is_subscribed': author_data['is_subscribed'],
             'avatar': author_data['avatar'],
+            'avatar_variants': author_data['avatar_variants'],
             'recipes_count': self.get_recipes_count(instance),
             'recipes': self.get_recipes(instance)
         }
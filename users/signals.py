@@ -0,0 +1,40 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.counters import shift
+from core.images import schedule_variants
+from core.pagination import invalidate_counts
+from users.models import Subscription, User
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_delete, sender=User)
+def reset_paginated_counts(sender, **kwargs):
+    invalidate_counts()
+
+
+@receiver(post_save, sender=User)
+def reset_counts_on_signup(sender, created, **kwargs):
+    # Изменение профиля не меняет число пользователей в списках
+    if created:
+        invalidate_counts()
+
+
+@receiver(post_save, sender=User)
+def make_avatar_variants(sender, instance, **kwargs):
+    schedule_variants(instance, 'avatar', 'avatar_variants')
+
+
+@receiver(post_save, sender=Subscription)
+def count_subscriber(sender, instance, created, **kwargs):
+    if created:
+        shift(User, instance.author_id, 'subscribers_count', 1)
+
+
+@receiver(post_delete, sender=Subscription)
+def uncount_subscriber(sender, instance, origin=None, **kwargs):
+    # Счётчик удаляемого автора обновлять незачем
+    if isinstance(origin, User) and origin.pk == instance.author_id:
+        return
+    shift(User, instance.author_id, 'subscribers_count', -1)
@@ -1,3 +1,188 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.conditional import changed_key
+from users.models import Subscription, User
+
+
+class UserListSubscriptionsTest(TestCase):
+    """Признак is_subscribed загружается одним запросом на страницу."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user(
+            email='viewer@example.com', username='viewer',
+            first_name='Viewer', last_name='Viewer', password='password'
+        )
+        cls.token = Token.objects.create(user=cls.viewer)
+        for i in range(20):
+            author = User.objects.create(
+                email=f'author{i}@example.com', username=f'author{i}',
+                first_name='Author', last_name=str(i)
+            )
+            if i % 2:
+                Subscription.objects.create(user=cls.viewer, author=author)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def get(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()
+
+    def test_user_list_queries_do_not_grow(self):
+        small, _ = self.get('/api/users/?limit=2')
+        large, data = self.get('/api/users/?limit=20')
+        self.assertEqual(small, large)
+        subscribed = set(Subscription.objects.filter(
+            user=self.viewer
+        ).values_list('author_id', flat=True))
+        for user in data['results']:
+            self.assertEqual(user['is_subscribed'], user['id'] in subscribed)
+
+    def test_me_is_not_subscribed(self):
+        _, data = self.get('/api/users/me/')
+        self.assertFalse(data['is_subscribed'])
+
+
+class SubscriptionListTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        from api.models import Recipe
+
+        cls.viewer = User.objects.create(
+            email='viewer@example.com', username='viewer',
+            first_name='Viewer', last_name='Viewer'
+        )
+        cls.token = Token.objects.create(user=cls.viewer)
+        for i in range(12):
+            author = User.objects.create(
+                email=f'author{i}@example.com', username=f'author{i}',
+                first_name='Author', last_name=str(i)
+            )
+            Recipe.objects.bulk_create(
+                Recipe(author=author, name=f'Рецепт {j}', text='Описание',
+                       cooking_time=10, image='recipes/test.png')
+                for j in range(i % 4)
+            )
+            Subscription.objects.create(user=cls.viewer, author=author)
+        # bulk_create не отправляет сигналы, счётчики сверяются явно
+        call_command('reconcile_counters', stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def get(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()
+
+    def test_page_costs_constant_queries(self):
+        small, _ = self.get(
+            '/api/users/subscriptions/?limit=2&recipes_limit=2'
+        )
+        large, data = self.get(
+            '/api/users/subscriptions/?limit=12&recipes_limit=2'
+        )
+        self.assertEqual(small, large)
+        self.assertEqual(len(data['results']), 12)
+        for author in data['results']:
+            total = int(author['last_name']) % 4
+            self.assertTrue(author['is_subscribed'])
+            self.assertEqual(author['recipes_count'], total)
+            self.assertEqual(len(author['recipes']), min(total, 2))
+
+    def test_without_recipes_limit(self):
+        _, data = self.get('/api/users/subscriptions/?limit=12')
+        for author in data['results']:
+            self.assertEqual(
+                len(author['recipes']), int(author['last_name']) % 4
+            )
+
+    def test_empty_subscriptions(self):
+        Subscription.objects.all().delete()
+        _, data = self.get('/api/users/subscriptions/')
+        self.assertEqual((data['count'], data['results']), (0, []))
+
+
+class ProfileConditionalGetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create(
+            email='viewer@example.com', username='viewer',
+            first_name='Viewer', last_name='Viewer'
+        )
+        cls.token = Token.objects.create(user=cls.viewer)
+        cls.author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author'
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_profile_revalidation(self):
+        url = f'/api/users/{self.author.id}/'
+        response = APIClient().get(url)
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(APIClient().get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        ).status_code, 304)
+
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304
+        )
+        # Подписка меняет is_subscribed, а значит и ETag
+        Subscription.objects.create(user=self.viewer, author=self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_subscribed'])
+
+    def test_profile_counters_change_last_modified(self):
+        url = f'/api/users/{self.author.id}/'
+        past = timezone.now() - timedelta(hours=1)
+        User.objects.filter(pk=self.author.pk).update(updated_at=past)
+        cache.set(changed_key(User), int(past.timestamp()), None)
+        since = APIClient().get(url)['Last-Modified']
+        self.assertEqual(APIClient().get(
+            url, HTTP_IF_MODIFIED_SINCE=since
+        ).status_code, 304)
+        Subscription.objects.create(user=self.viewer, author=self.author)
+        response = APIClient().get(url, HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['subscribers_count'], 1)
+
+        self.author.first_name = 'Renamed'
+        self.author.save()
+        self.assertEqual(self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag']
+        ).status_code, 200)
 
-# Create your tests here.
+    def test_me_has_etag(self):
+        etag = self.client.get('/api/users/me/')['ETag']
+        self.assertEqual(self.client.get(
+            '/api/users/me/', HTTP_IF_NONE_MATCH=etag
+        ).status_code, 304)
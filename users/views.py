@@ -6,10 +6,16 @@ from rest_framework.authtoken.models import Token
 from django.contrib.auth import get_user_model
 from rest_framework.views import APIView
 
+from core.conditional import (
+    changed_at, conditional, last_modified, make_etag
+)
+from core.ordering import StableOrderingFilter
 from core.pagination import CustomPagination
+from users.loaders import get_subscription_loader, load_recipe_previews
 from users.models import Subscription
 from users.serializers import (
-    CustomUserSerializer, SetPasswordSerializer, AvatarSerializer, TokenSerializer, SubscriptionSerializer
+    CustomUserSerializer, SetPasswordSerializer, AvatarSerializer,
+    TokenSerializer, SubscriptionSerializer, parse_recipes_limit
 )
 from rest_framework.decorators import action
 
@@ -20,6 +26,8 @@ User = get_user_model()
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
+    filter_backends = [StableOrderingFilter]
+    ordering_fields = ('recipes_count', 'subscribers_count')
 
     http_method_names = ['get', 'post', 'put', 'delete']
 
@@ -28,6 +36,25 @@ class UserViewSet(viewsets.ModelViewSet):
             return [IsAuthenticated()]
         return [AllowAny()]
 
+    def profile(self, user):
+        """Профиль с ETag и Last-Modified для условных GET."""
+        is_subscribed = get_subscription_loader(
+            self.request
+        ).is_subscribed(user.pk)
+        return conditional(
+            self.request,
+            make_etag(
+                user.pk, user.updated_at, is_subscribed,
+                *(getattr(user, field) for field in User.COUNTERS)
+            ),
+            # Счётчики меняются UPDATE без updated_at и отмечаются touch()
+            max(last_modified(user.updated_at), changed_at(User)),
+            lambda: Response(self.get_serializer(user).data)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.profile(self.get_object())
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -69,8 +96,7 @@ class UserViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated]
     )
     def me(self, request):
-        serializer = self.get_serializer(request.user)
-        return Response(serializer.data)
+        return self.profile(request.user)
 
     @action(
         methods=['post'],
@@ -137,6 +163,7 @@ class UserViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             Subscription.objects.create(user=user, author=author)
+            get_subscription_loader(request).set(author.id, True)
             return Response({"success": True}, status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
@@ -147,6 +174,7 @@ class UserViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             subscription.delete()
+            get_subscription_loader(request).set(author.id, False)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -185,17 +213,20 @@ class SubscriptionViewSet(viewsets.ViewSet):
 
     @action(detail=False, methods=['get'])
     def list(self, request):
-        queryset = Subscription.objects.filter(user=request.user)
-
-        if not queryset.exists():
-            return Response(
-                {'detail': 'У вас пока нет подписок'},
-                status=status.HTTP_200_OK
-            )
+        queryset = Subscription.objects.filter(
+            user=request.user
+        ).select_related('author').order_by('id')
 
         paginator = CustomPagination()
         page = paginator.paginate_queryset(queryset, request)
-        serializer = SubscriptionSerializer(page, many=True, context={'request': request})
+        # Превью рецептов всех авторов страницы загружаются одним запросом
+        previews = load_recipe_previews(
+            [subscription.author_id for subscription in page],
+            parse_recipes_limit(request)
+        )
+        serializer = SubscriptionSerializer(page, many=True, context={
+            'request': request, 'recipe_previews': previews
+        })
         return paginator.get_paginated_response(serializer.data)
 
     def subscribe(self, request, pk=None):
@@ -214,6 +245,7 @@ class SubscriptionViewSet(viewsets.ViewSet):
             if not created:
                 return Response({'error': 'Вы уже подписаны'}, status=status.HTTP_400_BAD_REQUEST)
 
+            get_subscription_loader(request).set(author.id, True)
             serializer = SubscriptionSerializer(subscription, context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 